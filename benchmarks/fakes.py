@@ -0,0 +1,443 @@
+#!/usr/bin/env python
+
+'''
+Local stand-ins for the Strapi, Unsplash, Trello and S3 endpoints used by fffutils, with configurable latency and
+error injection, plus generators for synthetic facts and cards.
+'''
+
+import json
+import time
+import random
+import datetime
+import hashlib
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = [
+    'impfung', 'virus', 'maske', 'studie', 'regierung', 'klima', 'wahl', 'strom', 'wasser', 'kinder', 'schule',
+    'arzt', 'krankenhaus', 'daten', 'handy', 'netz', 'bericht', 'test', 'zahlen', 'welt', 'europa', 'deutschland',
+    'polizei', 'gericht', 'gesetz', 'preis', 'energie', 'auto', 'bahn', 'flug', 'wetter', 'sommer', 'winter'
+]
+
+def sentence(rng, words = 8):
+    return(' '.join(rng.choice(WORDS) for i in range(words)).capitalize())
+
+def photo_bytes(key, size):
+    '''
+    Deterministic pseudo image content for key
+    '''
+    seed = hashlib.sha1(key.encode('utf-8')).digest()
+    return((seed * (size // len(seed) + 1))[:size])
+
+def generate_facts(count, seed = 0):
+    '''
+    Synthetic Strapi facts
+    '''
+    rng = random.Random(seed)
+    facts = list()
+    for i in range(count):
+        id = '{:024x}'.format(i + 1)
+        facts.append({
+            'id': id,
+            '_id': id,
+            'headline': sentence(rng, 6),
+            'snack': sentence(rng, 12) + '. ' + sentence(rng, 10) + '.',
+            'claim': 'Falsch: ' + sentence(rng, 8),
+            'url': 'https://example.org/{}'.format(i),
+            'category': rng.choice(['Gesundheit', 'Politik', 'Umwelt']),
+            'medium': 'Facebook',
+            'tags': '',
+            'date': '2020-06-01T00:00:00'
+        })
+    return(facts)
+
+def generate_board(count, list_id = 'incoming', seed = 0, image_share = 0.8, sharepic_share = 0.8):
+    '''
+    Synthetic Trello board: custom field definitions and cards with attachments and custom field items
+    '''
+    rng = random.Random(seed)
+    fields = [
+        {'id': 'field-id', 'name': 'ID', 'type': 'text'},
+        {'id': 'field-datum', 'name': 'Datum', 'type': 'text'},
+        {'id': 'field-kategorie', 'name': 'Kategorie', 'type': 'text'},
+        {'id': 'field-medium', 'name': 'Medium', 'type': 'text'},
+        {'id': 'field-tags', 'name': 'Tags', 'type': 'text'},
+        {'id': 'field-bild', 'name': 'Bild', 'type': 'text'}
+    ]
+
+    cards = list()
+    for i in range(count):
+        id = 'card{:020d}'.format(i)
+        attachments = [{'id': 'a{}'.format(i), 'name': 'Quelle', 'url': 'https://example.org/source/{}'.format(i)}]
+        if rng.random() < sharepic_share:
+            attachments.append({'id': 'p{}'.format(i), 'name': 'sharepic.png', 'url': '{trello}/attachments/' + id + '.png'})
+
+        items = [
+            {'idCustomField': 'field-datum', 'value': {'text': '2020-06-01T00:00:00'}},
+            {'idCustomField': 'field-kategorie', 'value': {'text': rng.choice(['Gesundheit', 'Politik', 'Umwelt'])}},
+            {'idCustomField': 'field-medium', 'value': {'text': 'Facebook'}}
+        ]
+        if rng.random() < image_share:
+            items.append({'idCustomField': 'field-bild', 'value': {'text': 'photo{}'.format(rng.randrange(count))}})
+
+        cards.append({
+            'id': id, 'name': sentence(rng, 6), 'desc': 'Falsch: ' + sentence(rng, 8) + ' === ' + sentence(rng, 14) + '.',
+            'dueComplete': False, 'closed': False, 'url': 'https://trello.com/c/' + id, 'pos': i, 'shortUrl': '',
+            'idMembers': [], 'idLabels': [], 'idBoard': 'board', 'idList': list_id, 'idShort': i,
+            'badges': {'checkItems': 0}, 'idChecklists': [], 'labels': [],
+            'dateLastActivity': '2020-06-01T00:00:00.000Z',
+            'attachments': attachments, 'customFieldItems': items
+        })
+    return({'fields': fields, 'cards': cards})
+
+class FakeService:
+    '''
+    Base class of a fake service: an HTTP server in a background thread with latency, error rate and request counters
+    '''
+    def __init__(self, latency = 0.0, error_rate = 0.0, seed = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counters = dict()
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self.handler())
+        self.server.daemon_threads = True
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+        threading.Thread(target = self.server.serve_forever, daemon = True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, key, value = 1):
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def reset(self):
+        with self.lock:
+            self.counters = dict()
+
+    def fail(self):
+        with self.lock:
+            return(self.random.random() < self.error_rate)
+
+    def route(self, method, path, query, body, headers):
+        '''
+        Returns (status, body, headers) for a request. Implemented by the services.
+        '''
+        return((404, {'error': 'Unknown path'}, dict()))
+
+    def handler(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def read_body(self):
+                if self.headers.get('Expect', '').lower() == '100-continue':
+                    self.send_response_only(100)
+                    self.end_headers()
+                if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+                    data = b''
+                    while True:
+                        size = int(self.rfile.readline().split(b';')[0].strip(), 16)
+                        if size == 0:
+                            # Trailers end with an empty line
+                            while self.rfile.readline().strip() != b'':
+                                pass
+                            return(data)
+                        data += self.rfile.read(size)
+                        self.rfile.readline()
+                length = int(self.headers.get('Content-Length', 0))
+                return(self.rfile.read(length) if length > 0 else b'')
+
+            def handle_request(self, method):
+                body = self.read_body()
+                parsed = urlparse(self.path)
+                query = dict((k, v[0] if len(v) == 1 else v) for (k, v) in parse_qs(parsed.query, keep_blank_values = True).items())
+
+                service.count('requests')
+                service.count('bytes_in', len(body))
+                if service.latency > 0:
+                    time.sleep(service.latency)
+
+                if service.fail():
+                    service.count('injected_errors')
+                    (status, payload, headers) = (503, {'error': 'Injected error'}, dict())
+                else:
+                    (status, payload, headers) = service.route(method, parsed.path, query, body, self.headers)
+
+                if isinstance(payload, (dict, list)):
+                    payload = json.dumps(payload).encode('utf-8')
+                    headers.setdefault('Content-Type', 'application/json')
+
+                service.count('bytes_out', len(payload))
+                self.send_response(status)
+                headers.setdefault('Content-Length', str(len(payload)))
+                for (key, value) in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                if method != 'HEAD':
+                    self.wfile.write(payload)
+
+            def do_GET(self):
+                self.handle_request('GET')
+
+            def do_POST(self):
+                self.handle_request('POST')
+
+            def do_PUT(self):
+                self.handle_request('PUT')
+
+            def do_HEAD(self):
+                self.handle_request('HEAD')
+
+            def do_DELETE(self):
+                self.handle_request('DELETE')
+
+        return(Handler)
+
+class FakeStrapi(FakeService):
+    '''
+    /facts, /recommendations and /collections of the Strapi REST API
+    '''
+    def __init__(self, facts = None, **kwargs):
+        self.tables = {'facts': list(facts or list()), 'recommendations': list(), 'collections': list()}
+        self.next_id = 10 ** 9
+        super().__init__(**kwargs)
+
+    def route(self, method, path, query, body, headers):
+        parts = [p for p in path.split('/') if p != '']
+        if len(parts) == 0 or parts[0] not in self.tables:
+            return((404, {'error': 'Unknown path'}, dict()))
+        table = self.tables[parts[0]]
+
+        if method == 'GET' and len(parts) == 1:
+            rows = table
+            for (key, value) in query.items():
+                if key.endswith('_in'):
+                    values = set(value if isinstance(value, list) else [value])
+                    rows = [r for r in rows if str(r.get(key[:-len('_in')])) in values]
+                elif not key.startswith('_'):
+                    rows = [r for r in rows if str(r.get(key)) == value]
+            start = int(query.get('_start', 0))
+            limit = int(query.get('_limit', 100))
+            return((200, rows[start:] if limit < 0 else rows[start:start + limit], dict()))
+
+        record = json.loads(body or b'{}')
+        with self.lock:
+            if method == 'POST' and len(parts) == 1:
+                self.next_id += 1
+                record['id'] = record['_id'] = '{:024x}'.format(self.next_id)
+                table.append(record)
+                return((200, record, dict()))
+
+            if method == 'PUT' and len(parts) == 2:
+                for row in table:
+                    if row.get('id') == parts[1]:
+                        row.update(record)
+                        return((200, row, dict()))
+                return((404, {'statusCode': 404, 'message': 'Not Found'}, dict()))
+
+            if method == 'DELETE' and len(parts) == 2:
+                for (i, row) in enumerate(table):
+                    if row.get('id') == parts[1]:
+                        return((200, table.pop(i), dict()))
+                return((404, {'statusCode': 404, 'message': 'Not Found'}, dict()))
+
+        return((405, {'error': 'Method not allowed'}, dict()))
+
+class FakeUnsplash(FakeService):
+    '''
+    /photos/<id> metadata and photo downloads
+    '''
+    def __init__(self, photo_size = 64 * 1024, **kwargs):
+        self.photo_size = photo_size
+        super().__init__(**kwargs)
+
+    def route(self, method, path, query, body, headers):
+        parts = [p for p in path.split('/') if p != '']
+        if len(parts) == 2 and parts[0] == 'photos':
+            urls = dict((size, '{}/download/{}-{}.jpg'.format(self.url, parts[1], size)) for size in ['raw', 'full', 'regular', 'small', 'thumb'])
+            return((200, {'id': parts[1], 'urls': urls}, dict()))
+        if len(parts) == 2 and parts[0] == 'download':
+            return((200, photo_bytes(parts[1], self.photo_size), {'Content-Type': 'image/jpeg'}))
+        return((404, {'error': 'Unknown path'}, dict()))
+
+class FakeTrello(FakeService):
+    '''
+    The board, card and attachment endpoints of the Trello API (under /1) used through py-trello
+    '''
+    def __init__(self, board = None, sharepic_size = 256 * 1024, **kwargs):
+        self.board = board or {'fields': list(), 'cards': list()}
+        self.sharepic_size = sharepic_size
+        self.activity = 0
+        super().__init__(**kwargs)
+
+        # Attachment URLs point to this server
+        for card in self.board['cards']:
+            for attachment in card['attachments']:
+                attachment['url'] = attachment['url'].replace('{trello}', self.url)
+        self.cards = dict((c['id'], c) for c in self.board['cards'])
+
+    def touch(self, card_id):
+        # Like Trello, every update of a card is activity on it
+        self.activity += 1
+        when = datetime.datetime(2020, 6, 2) + datetime.timedelta(milliseconds = self.activity)
+        self.cards[card_id]['dateLastActivity'] = when.isoformat(timespec = 'milliseconds') + 'Z'
+
+    def route(self, method, path, query, body, headers):
+        parts = [p for p in path.split('/') if p != '']
+        if len(parts) == 2 and parts[0] == 'attachments':
+            return((200, photo_bytes(parts[1], self.sharepic_size), {'Content-Type': 'image/png'}))
+        if len(parts) < 2 or parts[0] != '1':
+            return((404, {'error': 'Unknown path'}, dict()))
+        parts = parts[1:]
+
+        if method == 'GET' and parts[0] == 'boards':
+            if len(parts) == 2:
+                return((200, {'id': parts[1], 'name': 'Benchmark', 'desc': '', 'closed': False, 'url': ''}, dict()))
+            if parts[2] == 'customFields':
+                return((200, self.board['fields'], dict()))
+            if parts[2] == 'cards':
+                return((200, self.board['cards'], dict()))
+
+        # GET /cards/<id>
+        if method == 'GET' and parts[0] == 'cards' and len(parts) == 2 and parts[1] in self.cards:
+            card = self.cards[parts[1]]
+            fields = query.get('fields')
+            return((200, dict((k, v) for (k, v) in card.items() if fields is None or k in fields.split(',') or k == 'id'), dict()))
+
+        record = json.loads(body or b'{}')
+        with self.lock:
+            # PUT /cards/<id>/idList
+            if method == 'PUT' and parts[0] == 'cards' and len(parts) == 3 and parts[2] == 'idList':
+                self.cards[parts[1]]['idList'] = record.get('value')
+                self.touch(parts[1])
+                return((200, self.cards[parts[1]], dict()))
+
+            # PUT /card/<id>/customField/<field>/item
+            if method == 'PUT' and parts[0] == 'card' and len(parts) == 5:
+                card = self.cards[parts[1]]
+                card['customFieldItems'] = [i for i in card['customFieldItems'] if i['idCustomField'] != parts[3]]
+                card['customFieldItems'].append(dict(record, idCustomField = parts[3]))
+                self.touch(parts[1])
+                return((200, dict(record, idCustomField = parts[3]), dict()))
+
+        return((404, {'error': 'Unknown path'}, dict()))
+
+class FakeS3(FakeService):
+    '''
+    Path-style PUT/HEAD/GET of objects and multipart uploads
+    '''
+    def __init__(self, **kwargs):
+        self.objects = dict()
+        self.uploads = dict()
+        super().__init__(**kwargs)
+
+    def multipart(self, method, key, query, body):
+        if method == 'POST' and 'uploads' in query:
+            with self.lock:
+                upload_id = '{:016x}'.format(len(self.uploads) + 1)
+                self.uploads[upload_id] = dict()
+            xml = '<InitiateMultipartUploadResult><Bucket>{}</Bucket><Key>{}</Key><UploadId>{}</UploadId></InitiateMultipartUploadResult>'
+            return((200, xml.format(*key.split('/', 1), upload_id).encode('utf-8'), {'Content-Type': 'application/xml'}))
+
+        parts = self.uploads.get(query['uploadId'])
+        if parts is None:
+            return((404, b'<Error><Code>NoSuchUpload</Code></Error>', {'Content-Type': 'application/xml'}))
+        if method == 'PUT':
+            parts[int(query['partNumber'])] = body
+            return((200, b'', {'ETag': '"{}"'.format(hashlib.md5(body).hexdigest())}))
+        if method == 'DELETE':
+            self.uploads.pop(query['uploadId'])
+            return((204, b'', dict()))
+
+        # Complete: the ETag of a multipart object is the MD5 of the part MD5s and the number of parts
+        data = b''.join(parts[n] for n in sorted(parts))
+        etag = '"{}-{}"'.format(hashlib.md5(b''.join(hashlib.md5(parts[n]).digest() for n in sorted(parts))).hexdigest(), len(parts))
+        with self.lock:
+            self.objects[key] = (data, etag)
+            self.uploads.pop(query['uploadId'])
+        xml = '<CompleteMultipartUploadResult><Key>{}</Key><ETag>{}</ETag></CompleteMultipartUploadResult>'
+        return((200, xml.format(key, etag.replace('"', '&quot;')).encode('utf-8'), {'Content-Type': 'application/xml'}))
+
+    def route(self, method, path, query, body, headers):
+        key = path.lstrip('/')
+        if 'aws-chunked' in headers.get('Content-Encoding', ''):
+            body = decode_aws_chunked(body)
+        if 'uploads' in query or 'uploadId' in query:
+            return(self.multipart(method, key, query, body))
+
+        if method == 'PUT':
+            etag = '"{}"'.format(hashlib.md5(body).hexdigest())
+            with self.lock:
+                self.objects[key] = (body, etag)
+            return((200, b'', {'ETag': etag}))
+
+        if key not in self.objects:
+            return((404, b'', dict()))
+        (data, etag) = self.objects[key]
+        if method == 'HEAD':
+            return((200, b'', {'ETag': etag, 'Content-Length': str(len(data))}))
+        return((200, data, {'ETag': etag}))
+
+def decode_aws_chunked(body):
+    '''
+    Decodes a body sent with Content-Encoding: aws-chunked (used by newer botocore for checksums)
+    '''
+    data = b''
+    pos = 0
+    while pos < len(body):
+        end = body.index(b'\r\n', pos)
+        size = int(body[pos:end].split(b';')[0], 16)
+        if size == 0:
+            break
+        data += body[end + 2:end + 2 + size]
+        pos = end + 2 + size + 2
+    return(data)
+
+class FakeServices:
+    '''
+    All four fakes together. environment() returns the variables that point fffutils at them.
+    '''
+    def __init__(self, facts = None, board = None, latency = 0.0, error_rate = 0.0, seed = 0):
+        kwargs = {'latency': latency, 'error_rate': error_rate, 'seed': seed}
+        self.strapi = FakeStrapi(facts = facts, **kwargs)
+        self.unsplash = FakeUnsplash(**kwargs)
+        self.trello = FakeTrello(board = board, **kwargs)
+        self.s3 = FakeS3(**kwargs)
+
+    def services(self):
+        return({'strapi': self.strapi, 'unsplash': self.unsplash, 'trello': self.trello, 's3': self.s3})
+
+    def environment(self):
+        return({
+            'STRAPI_URL': self.strapi.url,
+            'STRAPI_AUTH_TOKEN': 'benchmark',
+            'UNSPLASH_API_URL': self.unsplash.url,
+            'UNSPLASH_ACCESS_KEY': 'benchmark',
+            'TRELLO_API_URL': self.trello.url + '/1',
+            'TRELLO_API_KEY': 'benchmark',
+            'TRELLO_API_SECRET': 'benchmark',
+            'S3_ENDPOINT_URL': self.s3.url,
+            'AWS_ACCESS_KEY_ID': 'benchmark',
+            'AWS_SECRET_ACCESS_KEY': 'benchmark',
+            'AWS_DEFAULT_REGION': 'eu-central-1'
+        })
+
+    def counters(self):
+        return(dict((name, dict(service.counters)) for (name, service) in self.services().items()))
+
+    def reset(self):
+        for service in self.services().values():
+            service.reset()
+
+    def stop(self):
+        for service in self.services().values():
+            service.stop()
@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+
+'''
+Offline benchmarks of the fff-utils actions against local fake services.
+
+    python -m benchmarks.run --scale 1000 10000 --latency 0.005 --out results.json
+
+Every scenario is run in-process against fresh fakes and reported as one JSON record with wall time and the
+requests/bytes seen by each fake service.
+'''
+
+import io
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import tempfile
+import contextlib
+
+from .fakes import FakeServices, generate_facts, generate_board
+
+def scenario_local_strapi(services, scale, workdir, bulk = False):
+    path = os.path.join(workdir, 'facts.jsonl')
+    with open(path, 'w') as f:
+        for fact in generate_facts(scale, seed = 1):
+            fact.pop('id')
+            fact.pop('_id')
+            f.write(json.dumps(fact) + '\n')
+
+    argv = ['local-strapi', '--data', path] + (['--bulk'] if bulk else list())
+    return(argv)
+
+def scenario_trello_strapi(services, scale, workdir, stream = False):
+    return(['trello-strapi', '--board', 'board', '--from-list', 'incoming', '--push'] + (['--stream-uploads'] if stream else list()))
+
+def scenario_trello_collections(services, scale, workdir):
+    return(['trello-collections', '--board', 'board', '--from-list', 'incoming'])
+
+def scenario_strapi_recommendations(services, scale, workdir):
+    try:
+        import spacy
+        spacy.load('de_core_news_sm')
+    except (ImportError, OSError) as e:
+        raise Skipped('spaCy model de_core_news_sm is not available: {}'.format(e))
+    return(['strapi-recommendations'])
+
+def scenario_strapi_recommendations_lexical(services, scale, workdir, engine):
+    return(['strapi-recommendations', '--engine', engine])
+
+SCENARIOS = {
+    'local-strapi': scenario_local_strapi,
+    'local-strapi-bulk': lambda services, scale, workdir: scenario_local_strapi(services, scale, workdir, bulk = True),
+    'trello-strapi': scenario_trello_strapi,
+    'trello-strapi-stream': lambda services, scale, workdir: scenario_trello_strapi(services, scale, workdir, stream = True),
+    'trello-collections': scenario_trello_collections,
+    'strapi-recommendations': scenario_strapi_recommendations,
+    'strapi-recommendations-tfidf': lambda services, scale, workdir: scenario_strapi_recommendations_lexical(services, scale, workdir, 'tfidf'),
+    'strapi-recommendations-bm25': lambda services, scale, workdir: scenario_strapi_recommendations_lexical(services, scale, workdir, 'bm25')
+}
+
+class Skipped(Exception):
+    pass
+
+def reset_clients():
+    '''
+    Drops the shared clients of the last scenario and points the services at the current fakes
+    '''
+    from fffutils import strapi, unsplash, aws
+    strapi.STRAPI_URL = os.environ['STRAPI_URL']
+    unsplash.UNSPLASH_API_URL = os.environ['UNSPLASH_API_URL']
+    strapi._client = None
+    unsplash._client = None
+    aws._client = None
+
+def run_scenario(name, scale, args, log):
+    facts = generate_facts(scale) if name.startswith('strapi-recommendations') else list()
+    board = generate_board(scale) if name in ['trello-strapi', 'trello-strapi-stream', 'trello-collections'] else None
+    services = FakeServices(facts = facts, board = board, latency = args.latency, error_rate = args.error_rate, seed = args.seed)
+    os.environ.update(services.environment())
+
+    record = {'scenario': name, 'scale': scale, 'latency': args.latency, 'error_rate': args.error_rate}
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            argv = SCENARIOS[name](services, scale, workdir)
+
+            # Imported after the environment points at the fakes
+            from fffutils.fffutils import build_parser
+            from fffutils import metrics
+            reset_clients()
+            metrics.reset()
+            command = build_parser().parse_args(argv)
+
+            services.reset()
+            output = io.StringIO()
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(output):
+                command.func(command, log)
+            record['seconds'] = time.perf_counter() - started
+            record['per_item_ms'] = 1000.0 * record['seconds'] / max(1, scale)
+            record['services'] = services.counters()
+            record['metrics'] = metrics.snapshot()
+            record['status'] = 'ok'
+    except Skipped as e:
+        record['status'] = 'skipped'
+        record['reason'] = str(e)
+    except Exception as e:
+        record['status'] = 'failed'
+        record['reason'] = '{}: {}'.format(type(e).__name__, e)
+    finally:
+        services.stop()
+
+    return(record)
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Offline benchmarks for fff-utils')
+    parser.add_argument('--scenarios', nargs = '+', choices = sorted(SCENARIOS.keys()), default = sorted(SCENARIOS.keys()))
+    parser.add_argument('--scale', nargs = '+', type = int, default = [1000], help = 'Number of facts/cards, e.g. 1000 10000 100000')
+    parser.add_argument('--latency', type = float, default = 0.0, help = 'Latency in seconds added to every fake request')
+    parser.add_argument('--error-rate', type = float, default = 0.0, help = 'Share of fake requests answered with 503')
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--out', type = str, default = None, help = 'File to write the JSON results to (default: stdout)')
+    parser.add_argument('--debug', action = 'store_true')
+    args = parser.parse_args()
+
+    log = logging.getLogger('benchmarks')
+    log.addHandler(logging.StreamHandler())
+    log.setLevel(logging.DEBUG if args.debug else logging.ERROR)
+
+    results = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'started': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'runs': list()
+    }
+    for scale in args.scale:
+        for name in args.scenarios:
+            record = run_scenario(name, scale, args, log)
+            detail = '{:.2f}s'.format(record['seconds']) if 'seconds' in record else record.get('reason', '')
+            print('{} x {}: {} {}'.format(name, scale, record['status'], detail), file = sys.stderr)
+            results['runs'].append(record)
+
+    if args.out is not None:
+        with open(args.out, 'w') as f:
+            json.dump(results, f, indent = 2)
+    else:
+        print(json.dumps(results, indent = 2))
+
+if __name__ == '__main__':
+    main()
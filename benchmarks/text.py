@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+'''
+Micro-benchmarks of the text preparation in fffutils.text against the per-item code it replaced.
+
+    python -m benchmarks.text --n 10000 --repeat 5
+
+Prints one JSON record per function with the best time per text (microseconds) of both versions.
+'''
+
+import re
+import json
+import timeit
+import argparse
+
+from fffutils import text
+from .fakes import generate_facts
+
+def legacy_stopwords():
+    return(list(text.STOPWORDS_DE))
+
+def legacy_slug(title):
+    from slugify import slugify
+    return(slugify(title, stopwords = legacy_stopwords()))
+
+def legacy_split_claim_fact(t, delim = '==='):
+    parts = [x.strip() for x in re.split(delim, t)]
+    if len(parts) == 1:
+        return(('', parts[0]))
+    return((parts[0], parts[1]))
+
+def legacy_recommender_text(fact):
+    return(fact["headline"] + fact["snack"].split(".")[0])
+
+def legacy_normalize_recommender_text(t):
+    return(" ".join([word.lower() for word in t.replace("Falsch:", "").replace("Fakt:", "").replace("-", " ").split(" ")]))
+
+def legacy_normalize_image_text(t, stop_words = text.STOPWORDS):
+    words = [word.lower() for word in t.replace("Falsch:", "").replace("-", " ").split(" ")]
+    return(" ".join([word for word in words if word not in stop_words]))
+
+def cases(facts):
+    titles = [d['headline'] for d in facts]
+    descriptions = [d['claim'] + ' === ' + d['snack'] for d in facts]
+    texts = [text.recommender_text(d) for d in facts]
+    return({
+        'slug': (lambda: [legacy_slug(t) for t in titles], lambda: text.slugs(titles)),
+        'split_claim_fact': (lambda: [legacy_split_claim_fact(t) for t in descriptions], lambda: text.split_claim_facts(descriptions)),
+        'recommender_text': (lambda: [legacy_recommender_text(d) for d in facts], lambda: [text.recommender_text(d) for d in facts]),
+        'normalize_recommender_text': (lambda: [legacy_normalize_recommender_text(t) for t in texts], lambda: list(text.normalize_recommender_texts(texts))),
+        'normalize_image_text': (lambda: [legacy_normalize_image_text(t) for t in descriptions], lambda: list(text.normalize_image_texts(descriptions)))
+    })
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Micro-benchmarks of fffutils.text')
+    parser.add_argument('--n', type = int, default = 10000, help = 'Number of texts per run')
+    parser.add_argument('--repeat', type = int, default = 5)
+    parser.add_argument('--functions', nargs = '+', default = None)
+    args = parser.parse_args()
+
+    facts = generate_facts(args.n)
+    for (name, (legacy, current)) in cases(facts).items():
+        if args.functions is not None and name not in args.functions:
+            continue
+
+        # Both versions have to agree before their times are compared
+        if legacy() != current():
+            raise AssertionError('{} returns other results than before'.format(name))
+
+        record = {'function': name, 'n': args.n}
+        for (key, f) in [('legacy_us', legacy), ('current_us', current)]:
+            record[key] = 1e6 * min(timeit.repeat(f, number = 1, repeat = args.repeat)) / args.n
+        record['speedup'] = record['legacy_us'] / record['current_us']
+        print(json.dumps(record))
+
+if __name__ == '__main__':
+    main()
@@ -4,43 +4,43 @@ import os
 import sys
 import json
 import datetime
-import dateutil.parser
-import spacy
-from slugify import slugify
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-from .trello import connect_board, get_custom_field_value, extract_attachments
-from .unsplash import retrieve_url, get_binary_photo
-from .aws import upload_object
-from .strapi import push, get_facts, add_recommendation, add_collection
-from .helper import split_claim_fact, stopwords
-from .nlp import find_similar_docs
+# Heavy dependencies (spaCy, boto3, py-trello, ...) are imported inside the actions, so every subcommand only
+# pays for the modules it uses.
 
 def trello_collections(args, log):
     '''
     Manages the upload of collections from a Trello board to the Strapi CMS.
     '''
-    # Get list to operate on
+    from .trello import BoardSnapshot, connect_board, get_custom_field_value, extract_attachments
+    from .strapi import add_collection
+
+    # Connect to the board
     board = connect_board(args.board, log)
-    input_list = board.get_list(args.from_list)
+
+    # Load cards, attachments and custom fields of the board in bulk
+    snapshot = BoardSnapshot(board, log)
 
     # Fetch custom field definitions
-    custom_fields_definition = board.get_custom_field_definitions()
+    custom_fields_definition = snapshot.field_definitions
     custom_fields_definition_list = dict(zip([x.name.lower() for x in custom_fields_definition], custom_fields_definition))
 
     results = list()
-    for card in input_list.list_cards():
+    for card in snapshot.list_cards(args.from_list):
         title = card.name
         comment = card.description
 
         # Extract custom fields
-        custom_fields = dict(zip([x.name.lower() for x in card.custom_fields], [x.value for x in card.custom_fields]))
+        custom_fields = snapshot.custom_fields(card.id)
         log.debug('Found custom fields {} on card {}'.format(','.join(custom_fields.keys()), title))
 
         id = get_custom_field_value('id', custom_fields, '', log=log)
         date = get_custom_field_value('datum', custom_fields, str(datetime.datetime.now().replace(microsecond=0).isoformat()), log=log)
 
         # Handle attachments
-        attachments = [a for a in extract_attachments(card) if a['type'] == 'source']
+        attachments = [a for a in extract_attachments(card, snapshot) if a['type'] == 'source']
 
         # Consolidate urls to id only
         facts = [os.path.split(a['url'])[1] for a in attachments]
@@ -58,153 +58,423 @@ def trello_collections(args, log):
 
     return(results)
 
-def trello_strapi(args, log):
+def trello_strapi(args, log, image_models = None):
     '''
     Manages the data upload from a Trello board to the Strapi CMS.
+    image_models (spaCy model and keyword matchers) are used for --recommend-images instead of loading them.
     '''
-    # Get list to operate on
+    from .trello import BoardSnapshot, connect_board
+    from .unsplash import PhotoCache
+    from .aws import Manifest
+    from .state import SyncState
+    from .strapi import Upserter
+
+    # Connect to the board
     board = connect_board(args.board, log)
-    input_list = board.get_list(args.from_list)
+
+    # Load cards, attachments and custom fields of the board in bulk
+    snapshot = BoardSnapshot(board, log)
 
     # Fetch custom field definitions
-    custom_fields_definition = board.get_custom_field_definitions()
+    custom_fields_definition = snapshot.field_definitions
     custom_fields_definition_list = dict(zip([x.name.lower() for x in custom_fields_definition], custom_fields_definition))
 
-    results = list()
-    for card in input_list.list_cards():
-        title = card.name
-        (claim, fact) = split_claim_fact(card.description)
-        slug = slugify(title, stopwords = stopwords())
-        
-        # Handle attachments to find URL and Sharepic
-        attachments = extract_attachments(card)
+    # Limit concurrent requests per external service
+    limits = {
+        'trello': threading.BoundedSemaphore(args.trello_limit),
+        'unsplash': threading.BoundedSemaphore(args.unsplash_limit),
+        's3': threading.BoundedSemaphore(args.s3_limit),
+        'strapi': threading.BoundedSemaphore(args.strapi_limit)
+    }
 
-        try:
-            source = [a for a in attachments if a['type'] == 'source'][0]['url']
-        except KeyError:
-            log.error('Missing source URL on snack {}'.format(title))
-            break
-        
-        sharepic_source_urls = [a for a in attachments if a['type'] == 'sharepic']
-
-        if len(sharepic_source_urls) > 0:
-            sharepic_source_url = sharepic_source_urls[0]['url']
-
-            # Construct auth header
-            trello_api_key = os.getenv('TRELLO_API_KEY', '')
-            trello_api_secret = os.getenv('TRELLO_API_SECRET', '')
-            headers = {'Authorization': 'OAuth oauth_consumer_key="{}", oauth_token="{}"'.format(trello_api_key, trello_api_secret)}
-            
-            # Upload image to AWS
-            upload_object(get_binary_photo(sharepic_source_url, headers=headers, log=log), slug+'.png', 'fff-sharepics', content_type = 'image/png', log=log)
-            sharepic_url = 'https://fff-sharepics.s3.amazonaws.com/'+slug+'.png'
-        else: 
-            sharepic_url = ''
-            log.debug('Missing sharepic URL on snack {}'.format(title))
-        
-        # Extract custom fields
-        custom_fields = dict(zip([x.name.lower() for x in card.custom_fields], [x.value for x in card.custom_fields]))
-        log.debug('Found custom fields {} on card {}'.format(','.join(custom_fields.keys()), title))
+    # Record of uploaded images, to skip unchanged uploads
+    manifest = Manifest(args.manifest, log = log)
 
-        id = get_custom_field_value('id', custom_fields, '', log=log)
-        date = get_custom_field_value('datum', custom_fields, str(datetime.datetime.now().replace(microsecond=0).isoformat()), log=log)
-        category = get_custom_field_value('kategorie', custom_fields, 'None', log=log)
-        medium = get_custom_field_value('medium', custom_fields, '', log=log)
-        tags = get_custom_field_value('tags', custom_fields, '', log=log)
-        image = get_custom_field_value('bild', custom_fields, '', log=log)
-
-        # Get unsplash image 
-        if image != '':
-            image_source_url = retrieve_url(image, 'regular', log=log)
-            
-            # Upload image to AWS
-            upload_object(get_binary_photo(image_source_url, log=log), image+'.jpg', 'fff-snack-images', log=log)
-
-            image_url = 'https://fff-snack-images.s3.amazonaws.com/'+image+'.jpg'
-            #log.debug('Uploaded image {} from Unsplash to AWS'.format(image))
-        else:
-            image_url = ''
-        
-        d = {
-            "_id": id,
-            "slug": slug,
-            "headline": title,
-            "claim": claim,
-            "snack": fact,
-            "url": source,
-            "date": date,
-            "category": category,
-            "medium": medium,
-            "tags": tags,
-            "image_url": image_url,
-            "sharepic_url": sharepic_url
-        }
-        log.debug('Final snack looks like {}'.format(d))
-
-        #
-        # Logic to push snack to Strapi if date is not newer
-        #
-        snack_date = dateutil.parser.parse(date)
-        if args.push and snack_date.date() <= datetime.date.today():
-            res = push(d, log)[0]
-
-            try:
-                response = json.loads(res.data)
-            except:
-                log.error('Received status {} with message: {}'.format(res['statusCode'], res['message']))
-
-            # Update ID from CMS
-            try:
-                card.set_custom_field(response['_id'], custom_fields_definition_list['id'])
-            except:
-                log.error('Could not to set card ID to {}'.format(response['_id']))
-        
-            if args.move_to != '' and res.status == 200:
+    # Cache for Unsplash lookups and downloads
+    photo_cache = PhotoCache(args.image_cache, max_bytes = args.image_cache_size * 1024 * 1024, log = log) if args.image_cache is not None else None
+
+    # Record of cards pushed before, to skip unchanged cards
+    state = SyncState(args.state, log = log) if args.state is not None else None
+
+    # Current records of the cards on Strapi, fetched in bulk, so unchanged snacks are not sent again
+    upserter = Upserter(log = log)
+
+    # Resized variants of uploaded images, rendered on a process pool
+    derivatives = None
+    if args.derivatives:
+        from .derivatives import DerivativeProcessor
+        derivatives = DerivativeProcessor(widths = args.derivative_widths, processes = args.derivative_processes, log = log)
+
+    cards = snapshot.list_cards(args.from_list)
+    if args.push:
+        upserter.prefetch([{'_id': snapshot.custom_fields(card.id).get('id', '').rstrip()} for card in cards])
+
+    # Image suggestions for all cards in one batched pass
+    if args.recommend_images:
+        suggestions = suggest_images(cards, snapshot, args, log, image_models = image_models)
+
+    # Cards are processed concurrently, side effects of a single card stay in order.
+    # Results are returned in list order.
+    with ThreadPoolExecutor(max_workers = args.workers) as executor:
+        futures = [executor.submit(process_card, card, snapshot, args, custom_fields_definition_list, limits, manifest, photo_cache, derivatives, upserter, state, log) for card in cards]
+        results = [f.result() for f in futures]
+
+    if args.recommend_images:
+        for (d, images) in zip(results, suggestions):
+            if d is not None:
+                log.debug('Suggested images for snack {}: {}'.format(d['headline'], ','.join(images)))
+                d['image_recommendations'] = images
+
+    manifest.save()
+    print(json.dumps(manifest.stats))
+
+    if photo_cache is not None:
+        photo_cache.save()
+        print(json.dumps(photo_cache.stats))
+
+    if args.push:
+        print(json.dumps(upserter.stats))
+
+    if state is not None:
+        state.close()
+
+    if derivatives is not None:
+        derivatives.close()
+
+    return([d for d in results if d is not None])
+
+def suggest_images(cards, snapshot, args, log, image_models = None):
+    '''
+    Runs the image recommender over headline and text of all cards, using the matcher of each card's category.
+    image_models is a loaded (nlp, matcher) pair, otherwise both are loaded from args.
+    '''
+    from .text import split_claim_facts
+    from .nlp import load_model
+    from .image import IMAGE_DISABLE, keyword_categories, load_keywords, load_keyword_matcher, recommend_images_batch
+
+    if image_models is not None:
+        (nlp, matcher) = image_models
+    else:
+        if not os.path.isdir(args.keywords_dir):
+            sys.exit('Could not find the image keyword directory {}. Please set --keywords-dir.'.format(args.keywords_dir))
+        nlp = load_model(disable = IMAGE_DISABLE)
+        categories = keyword_categories(args.keywords_dir)
+        keyword_dict = load_keywords(categories, nlp, data_dir = args.keywords_dir, cache_dir = args.keywords_cache, log = log)
+        matcher = load_keyword_matcher(keyword_dict, nlp, log = log)
+
+    texts = [card.name + ' ' + fact for (card, (claim, fact)) in zip(cards, split_claim_facts([card.description for card in cards]))]
+    card_categories = [snapshot.custom_fields(card.id).get('kategorie') for card in cards]
+
+    return(recommend_images_batch(texts, matcher, nlp, args.n_images, categories = card_categories))
+
+def process_card(card, snapshot, args, custom_fields_definition_list, limits, manifest, photo_cache, derivatives, upserter, state, log):
+    '''
+    Uploads images of a single card (and their resized variants, if derivatives is given) to S3,
+    pushes the changes of the snack to Strapi (with upserter) and updates the card. The card is only recorded
+    in state once all of its images are on S3, so failed uploads are retried on the next run.
+    '''
+    import dateutil.parser
+    from .trello import get_custom_field_value, extract_attachments, fetch_last_activity
+    from .unsplash import retrieve_url, get_binary_photo, open_photo
+    from .aws import upload_if_changed, stream_if_changed
+    from .text import split_claim_fact, slug as make_slug
+    from .state import snack_hash
+    from . import metrics
+
+    title = card.name
+
+    # Skip cards without activity since their last push
+    last_activity = snapshot.last_activity(card.id)
+    if state is not None and not args.full and state.is_unchanged(card.id, last_activity):
+        log.debug('Skipping unchanged card {}'.format(title))
+        metrics.count('cards.skipped')
+        return(None)
+
+    (claim, fact) = split_claim_fact(card.description)
+    slug = make_slug(title)
+
+    # Handle attachments to find URL and Sharepic
+    attachments = extract_attachments(card, snapshot)
+
+    try:
+        source = [a for a in attachments if a['type'] == 'source'][0]['url']
+    except (KeyError, IndexError):
+        log.error('Missing source URL on snack {}'.format(title))
+        return(None)
+
+    sharepic_source_urls = [a for a in attachments if a['type'] == 'sharepic']
+
+    # All images of the card are up to date on S3
+    complete = True
+
+    if len(sharepic_source_urls) > 0:
+        sharepic_source_url = sharepic_source_urls[0]['url']
+
+        # Construct auth header
+        trello_api_key = os.getenv('TRELLO_API_KEY', '')
+        trello_api_secret = os.getenv('TRELLO_API_SECRET', '')
+        headers = {'Authorization': 'OAuth oauth_consumer_key="{}", oauth_token="{}"'.format(trello_api_key, trello_api_secret)}
+
+        # Upload image to AWS, unless it was uploaded from the same attachment before
+        if not manifest.is_current(slug+'.png', 'fff-sharepics', sharepic_source_url) or (derivatives is not None and not derivatives.is_current(slug+'.png', 'fff-sharepics', manifest, sharepic_source_url)):
+            with metrics.span('card.sharepic'):
+                if args.stream_uploads and derivatives is None:
+                    # Pipe the download to S3 without buffering the whole image
+                    with limits['trello'], limits['s3']:
+                        (chunks, size) = open_photo(sharepic_source_url, headers=headers, log=log)
+                        complete = stream_if_changed(chunks, slug+'.png', 'fff-sharepics', manifest, content_type = 'image/png', source = sharepic_source_url, expected_size = size, log=log) and complete
+                else:
+                    with limits['trello']:
+                        sharepic = get_binary_photo(sharepic_source_url, headers=headers, log=log)
+                    with limits['s3']:
+                        complete = upload_if_changed(sharepic, slug+'.png', 'fff-sharepics', manifest, content_type = 'image/png', source = sharepic_source_url, log=log) and complete
+                    if derivatives is not None:
+                        complete = derivatives.process(sharepic, slug+'.png', 'fff-sharepics', manifest, limit = limits['s3'], source = sharepic_source_url) and complete
+        sharepic_url = 'https://fff-sharepics.s3.amazonaws.com/'+slug+'.png'
+    else:
+        sharepic_url = ''
+        log.debug('Missing sharepic URL on snack {}'.format(title))
+
+    # Extract custom fields
+    custom_fields = snapshot.custom_fields(card.id)
+    log.debug('Found custom fields {} on card {}'.format(','.join(custom_fields.keys()), title))
+
+    id = get_custom_field_value('id', custom_fields, '', log=log)
+    date = get_custom_field_value('datum', custom_fields, str(datetime.datetime.now().replace(microsecond=0).isoformat()), log=log)
+    category = get_custom_field_value('kategorie', custom_fields, 'None', log=log)
+    medium = get_custom_field_value('medium', custom_fields, '', log=log)
+    tags = get_custom_field_value('tags', custom_fields, '', log=log)
+    image = get_custom_field_value('bild', custom_fields, '', log=log)
+
+    # Get unsplash image
+    if image != '' and (not manifest.is_current(image+'.jpg', 'fff-snack-images', 'unsplash:'+image) or (derivatives is not None and not derivatives.is_current(image+'.jpg', 'fff-snack-images', manifest, 'unsplash:'+image))):
+        with metrics.span('card.image'):
+            if args.stream_uploads and derivatives is None and photo_cache is None:
+                # Pipe the download to S3 without buffering the whole image
+                with limits['unsplash']:
+                    image_source_url = retrieve_url(image, 'regular', log=log)
+                with limits['unsplash'], limits['s3']:
+                    (chunks, size) = open_photo(image_source_url, log=log) if image_source_url is not None else (None, None)
+                    complete = stream_if_changed(chunks, image+'.jpg', 'fff-snack-images', manifest, source = 'unsplash:'+image, expected_size = size, log=log) and complete
+            else:
+                with limits['unsplash']:
+                    image_source_url = retrieve_url(image, 'regular', log=log, cache=photo_cache)
+                    photo = get_binary_photo(image_source_url, log=log, cache=photo_cache)
+
+                # Upload image to AWS
+                with limits['s3']:
+                    complete = upload_if_changed(photo, image+'.jpg', 'fff-snack-images', manifest, source = 'unsplash:'+image, log=log) and complete
+                if derivatives is not None:
+                    complete = derivatives.process(photo, image+'.jpg', 'fff-snack-images', manifest, limit = limits['s3'], source = 'unsplash:'+image) and complete
+
+    if image != '':
+        image_url = 'https://fff-snack-images.s3.amazonaws.com/'+image+'.jpg'
+    else:
+        image_url = ''
+
+    d = {
+        "_id": id,
+        "slug": slug,
+        "headline": title,
+        "claim": claim,
+        "snack": fact,
+        "url": source,
+        "date": date,
+        "category": category,
+        "medium": medium,
+        "tags": tags,
+        "image_url": image_url,
+        "sharepic_url": sharepic_url
+    }
+    log.debug('Final snack looks like {}'.format(d))
+
+    #
+    # Logic to push snack to Strapi if date is not newer
+    #
+    snack_date = dateutil.parser.parse(date)
+    if args.push and snack_date.date() <= datetime.date.today():
+        # Activity on the card did not change the snack
+        h = snack_hash(d)
+        entry = state.get(card.id) if state is not None else None
+        if entry is not None and not args.full and entry[1] == h and entry[2] == id:
+            log.debug('Snack {} is unchanged, not pushing'.format(title))
+            metrics.count('cards.unchanged')
+            if complete:
+                state.record(card.id, last_activity, h, id)
+            return(d)
+
+        # Only changed fields are sent, unchanged snacks are skipped
+        with limits['strapi']:
+            result = upserter.upsert(d)
+
+        if result['error'] is not None:
+            log.error('Received status {} with message: {}'.format(result['status'], result['error']))
+            return(d)
+
+        # Update ID from CMS
+        updated = False
+        with limits['trello'], metrics.span('card.update'):
+            if result['id'] != id:
+                try:
+                    card.set_custom_field(result['id'], custom_fields_definition_list['id'])
+                    updated = True
+                except:
+                    log.error('Could not to set card ID to {}'.format(result['id']))
+
+            if args.move_to is not None and args.move_to != '':
                 # Remove labels?
                 card.change_list(args.move_to)
-        
-        results.append(d)
+                updated = True
 
-    return(results)
+            # Our own updates are activity on the card, which must not count as a change on the next run
+            if state is not None and updated and complete:
+                try:
+                    last_activity = fetch_last_activity(card)
+                except Exception as e:
+                    log.warning('Could not read the last activity of card {}: {}'.format(title, e))
+
+        if state is not None and complete:
+            state.record(card.id, last_activity, h, result['id'])
+
+    if state is not None and not complete:
+        log.warning('Not all images of snack {} are on S3, it is processed again on the next run'.format(title))
+
+    return(d)
 
 def local_strapi(args, log):
     '''
-    Uploads data from a local JSON file to Strapi
+    Uploads data from a local JSON or JSON Lines file (optionally gzip-compressed) to Strapi
     '''
-    with open(args.data, 'r') as json_file:
-        data = json.load(json_file)
-        responses = push(data, log)
+    from .reader import read_records
+    from .strapi import push, bulk_push, upsert, Upserter
+
+    # Records are streamed from the file while pushing
+    data = read_records(args.data)
 
-    return(responses)
+    if args.full:
+        # Send every record as it is
+        if args.bulk:
+            (responses, summary) = bulk_push(data, in_flight = args.in_flight, log = log)
+            print(json.dumps(summary))
+        else:
+            responses = push(data, log)
+        return(responses)
 
-def strapi_recommendations(args, log):
+    # Compare with the records on Strapi (or the local snapshot) and send only changes
+    upserter = Upserter(args.snapshot, log = log)
+    (results, summary) = upsert(data, upserter, in_flight = args.in_flight if args.bulk else 1, log = log)
+    upserter.save()
+    print(json.dumps(summary))
+
+    return(results)
+
+def strapi_recommendations(args, log, nlp = None):
+    '''
+    Renew fact recommendations on Strapi. nlp is a loaded spaCy model, otherwise it is loaded when facts need embedding.
+    '''
+    from .strapi import iter_facts, publish_recommendations
+    from .nlp import load_model, model_key, embed_facts
+    from .vectors import VectorStore
+    from . import metrics
+
+    # Facts are downloaded page by page, only the fields the recommender needs are kept
+    stream = iter_facts(page_size = args.page_size, concurrency = args.fetch_concurrency, fields = ['id', '_id', 'headline', 'snack'], log = log)
+
+    def embed(subset):
+        # load model only when facts need embedding, without the components the recommender does not use
+        return(embed_facts(subset, nlp if nlp is not None else load_model(), batch_size = args.batch_size, n_process = args.processes, log = log))
+
+    if args.engine in ['tfidf', 'bm25']:
+        # Sparse lexical engine, its term weights need the whole corpus
+        from .lexical import lexical_matrices
+
+        if args.store is not None:
+            log.warning('The {} engine does not use the vector store'.format(args.engine))
+        with metrics.span('recommender.fetch'):
+            facts = list(stream)
+        with metrics.span('recommender.embed', engine = args.engine):
+            matrix = lexical_matrices(facts, weighting = args.engine, log = log)
+    elif args.store is not None:
+        with metrics.span('recommender.fetch'):
+            facts = list(stream)
+        with metrics.span('recommender.embed'):
+            store = VectorStore(args.store, model = model_key(nlp = nlp), log = log)
+            matrix = store.sync(facts, embed)
+    else:
+        # Preprocess facts while later pages are still downloading
+        facts = list()
+        def collect():
+            for d in stream:
+                facts.append(d)
+                yield d
+        with metrics.span('recommender.fetch_embed'):
+            matrix = embed(collect())
+
+    with metrics.span('recommender.search', index = args.index):
+        neighbours = find_neighbours(facts, matrix, args, log)
+
+    # Push ids to strapi recommendation table, updating the records of earlier runs
+    recommendations = [(facts[i]['id'], [facts[index]['id'] for index in idx if index >= 0]) for (i, idx) in enumerate(neighbours)]
+    with metrics.span('recommender.publish'):
+        (results, summary) = publish_recommendations(recommendations, in_flight = args.in_flight, prune = args.prune_duplicates, log = log)
+    print(json.dumps(summary))
+
+    return(results)
+
+def find_neighbours(facts, matrix, args, log):
     '''
-    Renew fact recommendations on Strapi
+    Returns the indices of the args.n nearest other facts of every fact, with the index chosen by args.index
+    (matrix holds the query and document matrices of the lexical engines, which are always searched exactly)
     '''
-    facts = get_facts(limit = -1, log = log)
+    from .nlp import find_all_similar_docs
+    from .ann import IVFIndex, recall_report
+
+    if args.engine in ['tfidf', 'bm25']:
+        from .lexical import find_all_similar_docs as find_all_lexical
+
+        if args.index != 'exact':
+            log.warning('The {} engine does not support the {} index, searching exactly'.format(args.engine, args.index))
+        (queries, documents) = matrix
+        neighbours = find_all_lexical(queries, documents, n = args.n, log = log)
+    elif args.index == 'ivf':
+        # Approximate search, reuse a saved index if possible
+        ids = [d['id'] for d in facts]
+        if args.index_path is not None and os.path.exists(args.index_path):
+            index = IVFIndex.load(args.index_path)
+            index.add(matrix, ids, log = log)
+        else:
+            index = IVFIndex.build(matrix, ids, n_lists = args.lists, log = log)
 
-    # Get all headline + first sentence from all facts
-    raw_recommender_text = [d["headline"] + d["snack"].split(".")[0] for d in facts]
+        if args.index_path is not None:
+            index.save(args.index_path)
 
-    # load model
-    nlp = spacy.load('de_core_news_sm')
+        if args.recall_report:
+            print(json.dumps(recall_report(index, n = args.n, nprobe = args.nprobe)))
 
-    # Consolidate recommender text
-    recommender_text = [nlp(" ".join([word.lower() for word in text.replace("Falsch:", "").replace("Fakt:", "").replace("-", " ").split(" ")])) for text in raw_recommender_text]
+        neighbours = index.find_all_similar_docs(n = args.n, nprobe = args.nprobe, log = log)
+    else:
+        # Score all pairs at once and keep the n best other facts per fact
+        neighbours = find_all_similar_docs(matrix, n = args.n, log = log)
 
-    # transform texts to documents, use only nouns and propositions
-    docs = [nlp(' '.join(str(t) for t in doc if t.pos_ in ['NOUN', 'PROPN', 'ADJ'])) for doc in recommender_text]
+    return(neighbours)
 
-    responses = list()
-    for doc in docs:
-        if log is not None:
-            log.debug('Adding {} recommendations for {}'.format(args.n, doc))
-            
-        idx = find_similar_docs(doc, docs, n = args.n + 1, log = log)
+def image_keywords(args, log):
+    '''
+    Compiles the keyword patterns of the image recommender, so later runs can load them from cache
+    '''
+    from .nlp import load_model
+    from .image import IMAGE_DISABLE, keyword_categories, load_keywords
 
-        # Push ids to strapi recommendation table
-        fact = facts[idx[args.n]]['id']
-        recommendations = [facts[index] for index in idx[:-1]]
+    nlp = load_model(disable = IMAGE_DISABLE)
+    categories = args.categories if args.categories is not None else keyword_categories(args.data_dir)
 
-        responses.append(add_recommendation(fact, recommendations, log = log))
+    keyword_dict = load_keywords(categories, nlp, data_dir = args.data_dir, cache_dir = args.cache_dir, log = log)
+    return(keyword_dict)
+
+def serve(args, log):
+    '''
+    Runs the long-running worker (see server.py)
+    '''
+    from .server import serve as run_server
 
+    return(run_server(args, log))
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+from .nlp import normalize_rows
+
+class IVFIndex:
+    '''
+    Approximate nearest neighbour index for row-normalized matrices (inverted file). Rows are clustered with spherical
+    k-means, and a query only scores the rows of its nprobe closest clusters.
+    '''
+    def __init__(self, centroids, ids = None, assignments = None):
+        self.centroids = normalize_rows(centroids)
+        self.ids = ids
+        self.assignments = assignments
+        self.matrix = None
+
+    @classmethod
+    def build(cls, matrix, ids = None, n_lists = None, iterations = 10, sample_size = 65536, seed = 0, log = None):
+        '''
+        Trains centroids on (a sample of) matrix and adds all rows to the index
+        '''
+        size = matrix.shape[0]
+        if n_lists is None:
+            n_lists = max(1, int(np.sqrt(size)))
+        n_lists = max(1, min(n_lists, size))
+
+        rng = np.random.default_rng(seed)
+        sample = np.asarray(matrix[np.sort(rng.choice(size, min(size, sample_size), replace = False))], dtype = np.float32)
+        centroids = sample[rng.choice(sample.shape[0], n_lists, replace = False)]
+
+        for iteration in range(iterations):
+            labels = assign_rows(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            counts = np.bincount(labels, minlength = n_lists)
+
+            # Re-seed empty clusters with random rows
+            empty = np.where(counts == 0)[0]
+            sums[empty] = sample[rng.choice(sample.shape[0], len(empty))]
+            centroids = normalize_rows(sums)
+
+            if log is not None:
+                log.debug('k-means iteration {}: {} empty lists'.format(iteration + 1, len(empty)))
+
+        index = cls(centroids)
+        index.add(matrix, ids, log = log)
+        return(index)
+
+    @classmethod
+    def load(cls, path):
+        '''
+        Loads an index saved with save(). Call add() before searching.
+        '''
+        with np.load(path, allow_pickle = False) as data:
+            ids = [str(x) for x in data['ids']] if 'ids' in data else None
+            assignments = data['assignments'] if 'assignments' in data else None
+            return(cls(data['centroids'], ids, assignments))
+
+    def save(self, path):
+        '''
+        Saves centroids and row assignments to an .npz file
+        '''
+        data = {'centroids': self.centroids}
+        if self.ids is not None and self.assignments is not None:
+            data['ids'] = np.array(self.ids, dtype = str)
+            data['assignments'] = self.assignments
+        with open(path, 'wb') as f:
+            np.savez(f, **data)
+
+    def add(self, matrix, ids = None, log = None):
+        '''
+        Attaches the rows of matrix to the index. Assignments from a loaded index are reused if the ids did not change.
+        '''
+        ids = [str(x) for x in ids] if ids is not None else None
+        if self.assignments is None or ids is None or ids != self.ids or len(self.assignments) != matrix.shape[0]:
+            if log is not None:
+                log.debug('Assigning {} rows to {} lists'.format(matrix.shape[0], self.centroids.shape[0]))
+            self.assignments = assign_rows(matrix, self.centroids)
+
+        self.ids = ids
+        self.matrix = matrix
+        self.order = np.argsort(self.assignments, kind = 'stable')
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(self.assignments, minlength = self.centroids.shape[0]))])
+
+    def search(self, queries, n = 3, nprobe = 8, exclude = None):
+        '''
+        Returns the indices of the n best rows per query, ordered by decreasing similarity. Rows listed in exclude (one
+        row index per query, e.g. the query itself) are skipped. Missing neighbours are returned as -1.
+        '''
+        queries = np.asarray(queries, dtype = np.float32)
+        size = queries.shape[0]
+        nprobe = max(1, min(nprobe, self.centroids.shape[0]))
+
+        best_scores = np.full((size, n), -np.inf, dtype = np.float32)
+        best_idx = np.full((size, n), -1, dtype = np.int64)
+        if size == 0 or n == 0:
+            return(best_idx)
+
+        # Closest lists per query
+        probes = np.argpartition(-(queries @ self.centroids.T), nprobe - 1, axis = 1)[:, :nprobe]
+
+        for lst in range(self.centroids.shape[0]):
+            members = self.order[self.offsets[lst]:self.offsets[lst + 1]]
+            selected = np.where((probes == lst).any(axis = 1))[0]
+            if len(members) == 0 or len(selected) == 0:
+                continue
+
+            scores = queries[selected] @ np.asarray(self.matrix[members]).T
+            if exclude is not None:
+                scores[members[None, :] == np.asarray(exclude)[selected, None]] = -np.inf
+
+            # Merge with the best rows found so far
+            scores = np.concatenate([best_scores[selected], scores], axis = 1)
+            candidates = np.concatenate([best_idx[selected], np.broadcast_to(members, (len(selected), len(members)))], axis = 1)
+            top = np.argpartition(-scores, n - 1, axis = 1)[:, :n]
+            rows = np.arange(len(selected))[:, None]
+            best_scores[selected] = scores[rows, top]
+            best_idx[selected] = candidates[rows, top]
+
+        order = np.argsort(-best_scores, axis = 1, kind = 'stable')
+        rows = np.arange(size)[:, None]
+        best_idx = best_idx[rows, order]
+        best_idx[np.isneginf(best_scores[rows, order])] = -1
+        return(best_idx)
+
+    def find_all_similar_docs(self, n = 3, nprobe = 8, block_size = 1024, log = None):
+        '''
+        Approximate counterpart of nlp.find_all_similar_docs for the rows of the index itself
+        '''
+        size = self.matrix.shape[0]
+        result = np.full((size, n), -1, dtype = np.int64)
+        for start in range(0, size, block_size):
+            end = min(start + block_size, size)
+            if log is not None:
+                log.debug('Searching documents {} to {} of {}'.format(start, end, size))
+            result[start:end] = self.search(self.matrix[start:end], n = n, nprobe = nprobe, exclude = np.arange(start, end))
+        return(result)
+
+def assign_rows(matrix, centroids, block_size = 4096):
+    '''
+    Returns the index of the most similar centroid for every row of matrix
+    '''
+    labels = np.zeros(matrix.shape[0], dtype = np.int64)
+    for start in range(0, matrix.shape[0], block_size):
+        end = min(start + block_size, matrix.shape[0])
+        labels[start:end] = np.argmax(np.asarray(matrix[start:end]) @ centroids.T, axis = 1)
+    return(labels)
+
+def recall_report(index, n = 3, nprobe = 8, sample_size = 1000, seed = 0):
+    '''
+    Compares approximate neighbours of a random sample of rows with the exact ones. Returns a dict with recall@n.
+    '''
+    size = index.matrix.shape[0]
+    rng = np.random.default_rng(seed)
+    sample = np.sort(rng.choice(size, min(size, sample_size), replace = False))
+
+    approximate = index.search(index.matrix[sample], n = n, nprobe = nprobe, exclude = sample)
+
+    # Exact neighbours of the sample against the full matrix
+    scores = np.asarray(index.matrix[sample]) @ np.asarray(index.matrix).T
+    scores[np.arange(len(sample)), sample] = -np.inf
+    k = min(n, size - 1)
+    exact = np.argpartition(-scores, k - 1, axis = 1)[:, :k] if k > 0 else np.zeros((len(sample), 0), dtype = np.int64)
+
+    hits = sum(len(set(a[a >= 0]) & set(e)) for (a, e) in zip(approximate, exact))
+    return({
+        'queries': len(sample),
+        'n': n,
+        'nprobe': nprobe,
+        'lists': index.centroids.shape[0],
+        'recall': hits / float(max(1, len(sample) * k))
+    })
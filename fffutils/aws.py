@@ -2,19 +2,270 @@
 
 import os
 import sys
+import json
+import time
+import base64
+import hashlib
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import boto3
+from botocore.config import Config
+
+from . import metrics
+
+# Size of the parts of streamed uploads. S3 requires at least 5 MB for all but the last part.
+PART_SIZE = 8 * 1024 * 1024
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    '''
+    Returns the S3 client shared by all uploads of a run. Requires ~/.aws/credentials
+    '''
+    global _client
+    with _client_lock:
+        if _client is None:
+            # S3_ENDPOINT_URL points uploads to an S3-compatible service instead of AWS
+            endpoint = os.getenv('S3_ENDPOINT_URL', '')
+            if endpoint != '':
+                _client = boto3.client('s3', endpoint_url = endpoint, config = Config(s3 = {'addressing_style': 'path'}))
+            else:
+                _client = boto3.client('s3')
+    return(_client)
 
 def upload_object(data, key, bucket, content_type = 'image/jpeg', log = None):
     '''
     Uploads a binary data stream to a S3 bucket. Requires ~/.aws/credentials
     '''
-    s3 = boto3.resource('s3')
+    s3 = get_client()
 
-    try: 
-        s3.Bucket(bucket).put_object(Key=key, Body=data, ContentType = content_type)
+    try:
+        with metrics.span('s3.put_object', bucket = bucket):
+            s3.put_object(Bucket=bucket, Key=key, Body=data, ContentType = content_type)
+        metrics.count('s3.bytes_sent', len(data), bucket = bucket)
         if log is not None:
             log.debug('Uploading {} to bucket {} on S3'.format(key, bucket))
+        return(True)
     except Exception as e:
         if log is not None:
             log.error(e)
-        pass
\ No newline at end of file
+        return(False)
+
+def read_parts(chunks, part_size = PART_SIZE):
+    '''
+    Regroups a stream of byte chunks into parts of part_size bytes (the last one may be smaller)
+    '''
+    buffer = bytearray()
+    for chunk in chunks:
+        buffer.extend(chunk)
+        while len(buffer) >= part_size:
+            yield bytes(buffer[:part_size])
+            del buffer[:part_size]
+    if len(buffer) > 0:
+        yield bytes(buffer)
+
+def upload_part(s3, key, bucket, upload_id, number, data):
+    '''
+    Uploads one part of a multipart upload with its MD5, so S3 rejects corrupted parts. Returns the ETag of the part,
+    which is not the MD5 under SSE-KMS or SSE-C encryption.
+    '''
+    digest = hashlib.md5(data)
+    with metrics.span('s3.upload_part', bucket = bucket):
+        etag = s3.upload_part(Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=data,
+            ContentMD5 = base64.b64encode(digest.digest()).decode('ascii'))['ETag'].strip('"')
+    metrics.count('s3.bytes_sent', len(data), bucket = bucket)
+    return(etag)
+
+@metrics.timed('s3.upload_stream')
+def upload_stream(chunks, key, bucket, content_type = 'image/jpeg', part_size = PART_SIZE, concurrency = 4, expected_size = None, log = None):
+    '''
+    Uploads a stream of byte chunks (e.g. from unsplash.stream_photo) to a S3 bucket without holding it in memory.
+    Objects larger than part_size are sent as multipart upload with up to concurrency parts in flight, so only about
+    (concurrency + 2) * part_size bytes are buffered. Every part is verified by its MD5 and the total size against
+    expected_size, if given. Returns (md5, size) of the content, or None if the upload failed.
+    '''
+    s3 = get_client()
+    parts = read_parts(chunks, part_size)
+    md5 = hashlib.md5()
+    size = 0
+    upload_id = None
+
+    try:
+        first = next(parts, None)
+        second = next(parts, None)
+        if first is None:
+            raise ValueError('Received no data for {}'.format(key))
+
+        if second is None:
+            # Small objects are sent in one request
+            md5.update(first)
+            size = len(first)
+            if expected_size is not None and size != expected_size:
+                raise ValueError('Received {} of {} bytes for {}'.format(size, expected_size, key))
+            with metrics.span('s3.put_object', bucket = bucket):
+                s3.put_object(Bucket=bucket, Key=key, Body=first, ContentType = content_type,
+                    ContentMD5 = base64.b64encode(md5.digest()).decode('ascii'))
+            metrics.count('s3.bytes_sent', size, bucket = bucket)
+        else:
+            upload_id = s3.create_multipart_upload(Bucket=bucket, Key=key, ContentType = content_type)['UploadId']
+            slots = threading.BoundedSemaphore(concurrency)
+            futures = list()
+            with ThreadPoolExecutor(max_workers = concurrency) as executor:
+                for (number, part) in enumerate(itertools.chain([first, second], parts), 1):
+                    md5.update(part)
+                    size += len(part)
+
+                    # Wait for a free slot before reading on, and stop at the first failed part
+                    slots.acquire()
+                    for future in futures:
+                        if future.done() and future.exception() is not None:
+                            raise future.exception()
+                    future = executor.submit(upload_part, s3, key, bucket, upload_id, number, part)
+                    future.add_done_callback(lambda f: slots.release())
+                    futures.append(future)
+                etags = [f.result() for f in futures]
+
+            if expected_size is not None and size != expected_size:
+                raise ValueError('Received {} of {} bytes for {}'.format(size, expected_size, key))
+            s3.complete_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id,
+                MultipartUpload = {'Parts': [{'ETag': '"{}"'.format(etag), 'PartNumber': number} for (number, etag) in enumerate(etags, 1)]})
+
+        if log is not None:
+            log.debug('Streamed {} bytes to {} in bucket {} on S3'.format(size, key, bucket))
+        return((md5.hexdigest(), size))
+    except Exception as e:
+        if log is not None:
+            log.error('Streaming {} to bucket {} failed: {}'.format(key, bucket, e))
+        if upload_id is not None:
+            try:
+                s3.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+            except Exception:
+                pass
+        return(None)
+
+def remote_md5(key, bucket):
+    '''
+    Returns the MD5 of an object from its ETag, or None if the object is missing or was a multipart upload
+    '''
+    started = time.perf_counter()
+    try:
+        etag = get_client().head_object(Bucket=bucket, Key=key)['ETag'].strip('"')
+    except Exception:
+        # Missing objects are expected, they are not counted as errors
+        metrics.count('s3.head_misses', bucket = bucket)
+        return(None)
+    finally:
+        metrics.observe('s3.head_object', time.perf_counter() - started, bucket = bucket)
+
+    if '-' in etag:
+        return(None)
+    return(etag)
+
+class Manifest:
+    '''
+    Local record of uploaded objects (MD5 and source URL per bucket/key), used to skip unchanged uploads.
+    Without a path, nothing is persisted and only the object ETags on S3 are checked.
+    '''
+    def __init__(self, path = None, log = None):
+        self.path = path
+        self.log = log
+        self.entries = dict()
+        self.lock = threading.Lock()
+        self.stats = {'uploaded': 0, 'skipped': 0, 'failed': 0, 'bytes_uploaded': 0, 'bytes_saved': 0}
+
+        if path is not None and os.path.exists(path):
+            with open(path, 'r') as f:
+                self.entries = json.load(f)
+
+    def save(self):
+        if self.path is None:
+            return
+        with self.lock:
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(self.entries, f)
+            os.replace(self.path + '.tmp', self.path)
+
+    def is_current(self, key, bucket, source):
+        '''
+        Checks if the object was uploaded from source before, so the source does not need to be downloaded again
+        '''
+        with self.lock:
+            entry = self.entries.get(bucket + '/' + key)
+            if entry is None or source is None or entry.get('source') != source:
+                return(False)
+            self.stats['skipped'] += 1
+            self.stats['bytes_saved'] += entry.get('size', 0)
+            metrics.count('cache.hits', cache = 's3_manifest')
+            metrics.count('s3.bytes_saved', entry.get('size', 0), bucket = bucket)
+            return(True)
+
+    def record(self, key, bucket, md5, size, source = None, uploaded = True):
+        with self.lock:
+            self.entries[bucket + '/' + key] = {'md5': md5, 'size': size, 'source': source}
+            if uploaded:
+                self.stats['uploaded'] += 1
+                self.stats['bytes_uploaded'] += size
+            else:
+                self.stats['skipped'] += 1
+                self.stats['bytes_saved'] += size
+                metrics.count('s3.bytes_saved', size, bucket = bucket)
+
+    def annotate(self, key, bucket, source, **fields):
+        '''
+        Adds fields (e.g. the width of an image) to the entry of an object, if it was uploaded from source
+        '''
+        with self.lock:
+            entry = self.entries.get(bucket + '/' + key)
+            if entry is not None and entry.get('source') == source:
+                entry.update(fields)
+
+    def failed(self):
+        with self.lock:
+            self.stats['failed'] += 1
+
+@metrics.timed('s3.upload_if_changed')
+def upload_if_changed(data, key, bucket, manifest, content_type = 'image/jpeg', source = None, log = None):
+    '''
+    Uploads data unless the same content is already stored under key (checked against manifest, then the ETag on S3).
+    Returns True if the object on S3 is up to date afterwards. data is None for failed downloads, which are never
+    recorded, so the source is downloaded again on the next run.
+    '''
+    if data is None:
+        manifest.failed()
+        return(False)
+
+    md5 = hashlib.md5(data).hexdigest()
+    entry = manifest.entries.get(bucket + '/' + key)
+
+    if (entry is not None and entry.get('md5') == md5) or remote_md5(key, bucket) == md5:
+        if log is not None:
+            log.debug('Skipping unchanged {} in bucket {}'.format(key, bucket))
+        manifest.record(key, bucket, md5, len(data), source = source, uploaded = False)
+        return(True)
+
+    if upload_object(data, key, bucket, content_type = content_type, log = log):
+        manifest.record(key, bucket, md5, len(data), source = source)
+        return(True)
+
+    manifest.failed()
+    return(False)
+
+def stream_if_changed(chunks, key, bucket, manifest, content_type = 'image/jpeg', source = None, expected_size = None, log = None):
+    '''
+    Streams chunks to S3 (see upload_stream) and records the upload in manifest. Unlike upload_if_changed, the content
+    is only known after it was sent, so unchanged sources have to be skipped with manifest.is_current beforehand.
+    Returns True if the object on S3 is up to date afterwards.
+    '''
+    if chunks is None:
+        manifest.failed()
+        return(False)
+
+    result = upload_stream(chunks, key, bucket, content_type = content_type, expected_size = expected_size, log = log)
+    if result is None:
+        manifest.failed()
+        return(False)
+
+    manifest.record(key, bucket, result[0], result[1], source = source)
+    return(True)
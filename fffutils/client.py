@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+
+import urllib3
+
+from . import metrics
+
+# Settings for clients created after configure()
+DEFAULTS = {
+    'pool_size': 10,
+    'timeout': 30.0,
+    'retries': 3,
+    'backoff': 0.5
+}
+
+def configure(**kwargs):
+    '''
+    Changes the connection settings used for new clients (pool_size, timeout, retries, backoff)
+    '''
+    for (key, value) in kwargs.items():
+        if key not in DEFAULTS:
+            raise ValueError('Unknown client setting {}'.format(key))
+        if value is not None:
+            DEFAULTS[key] = value
+
+class Client:
+    '''
+    Keep-alive HTTP client for one service. At most pool_size connections per host are open, further requests wait
+    for a free one. Retries with exponential backoff: connection errors of every request,
+    read errors and 5xx responses only of idempotent requests (GET, PUT, DELETE, ...), so a POST the server may already
+    have committed is never sent twice.
+    Requests, bytes, retries, errors and latencies are reported to metrics under the service name.
+    '''
+    def __init__(self, name = 'http', headers = None, pool_size = None, timeout = None, retries = None, backoff = None):
+        self.name = name
+        self.headers = headers if headers is not None else dict()
+        self.pool_size = pool_size if pool_size is not None else DEFAULTS['pool_size']
+
+        retry = urllib3.Retry(
+            total = retries if retries is not None else DEFAULTS['retries'],
+            backoff_factor = backoff if backoff is not None else DEFAULTS['backoff'],
+            status_forcelist = [500, 502, 503, 504],
+            allowed_methods = urllib3.Retry.DEFAULT_ALLOWED_METHODS,
+            raise_on_status = False)
+
+        self.http = urllib3.PoolManager(
+            maxsize = self.pool_size,
+            block = True,
+            timeout = urllib3.Timeout(total = timeout if timeout is not None else DEFAULTS['timeout']),
+            retries = retry)
+
+    def request(self, method, url, body = None, headers = None, **kwargs):
+        '''
+        Sends a request with the client headers (merged with headers) and returns the urllib3 response
+        '''
+        merged = dict(self.headers)
+        if headers is not None:
+            merged.update(headers)
+
+        if body is not None:
+            metrics.count('http.bytes_sent', len(body), service = self.name)
+        with metrics.span('http.request', service = self.name):
+            r = self.http.request(method, url, body = body, headers = merged, **kwargs)
+
+        metrics.count('http.requests', service = self.name, status = '{}xx'.format(r.status // 100))
+        if r.retries is not None and len(r.retries.history) > 0:
+            metrics.count('http.retries', len(r.retries.history), service = self.name)
+        # Streamed bodies are counted by the caller
+        if kwargs.get('preload_content', True):
+            metrics.count('http.bytes_received', len(r.data), service = self.name)
+        return(r)
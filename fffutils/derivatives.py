@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+import io
+import os
+import sys
+import contextlib
+import importlib.util
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from . import metrics
+
+# Widths (px) of the resized variants
+DERIVATIVE_WIDTHS = (480, 960, 1600)
+
+# Formats of the variants by extension of the original object
+DERIVATIVE_FORMATS = {
+    'jpg': ('webp', 'jpg'),
+    'png': ('webp', 'png')
+}
+
+CONTENT_TYPES = {
+    'webp': 'image/webp',
+    'jpg': 'image/jpeg',
+    'png': 'image/png'
+}
+
+def derivative_key(key, width, format):
+    '''
+    Returns the key of a variant next to the original object, e.g. snack.jpg -> snack-480w.webp
+    '''
+    return('{}-{}w.{}'.format(os.path.splitext(key)[0], width, format))
+
+def render_derivatives(data, widths, formats, quality = 80):
+    '''
+    Resizes and recompresses an image to every width and format. Widths above the original width are skipped.
+    Returns the original width and a list of (width, format, data). Runs in the worker processes.
+    '''
+    from PIL import Image, ImageOps
+
+    original = ImageOps.exif_transpose(Image.open(io.BytesIO(data)))
+    variants = list()
+    for width in sorted(widths):
+        if width >= original.width:
+            break
+        height = max(1, round(original.height * width / original.width))
+        resized = original.resize((width, height), Image.LANCZOS)
+
+        for format in formats:
+            out = io.BytesIO()
+            if format == 'jpg':
+                resized.convert('RGB').save(out, 'JPEG', quality = quality, optimize = True, progressive = True)
+            elif format == 'webp':
+                resized.save(out, 'WEBP', quality = quality, method = 4)
+            else:
+                resized.save(out, 'PNG', optimize = True)
+            variants.append((width, format, out.getvalue()))
+
+    return((original.width, variants))
+
+class DerivativeProcessor:
+    '''
+    Generates resized variants of uploaded images on a process pool and uploads them next to the original.
+    Requires Pillow (pip install fff-utils[images]).
+    '''
+    def __init__(self, widths = DERIVATIVE_WIDTHS, processes = None, quality = 80, log = None):
+        if importlib.util.find_spec('PIL') is None:
+            sys.exit('Generating image derivatives requires Pillow. Please install fff-utils[images].')
+
+        self.widths = widths
+        self.quality = quality
+        self.log = log
+        # The pool is started from the card threads, forking a multi-threaded process is not safe
+        self.executor = ProcessPoolExecutor(max_workers = processes, mp_context = multiprocessing.get_context('spawn'))
+
+    def is_current(self, key, bucket, manifest, source):
+        '''
+        Checks if the variants of key were uploaded from source before (by the smallest variant, which every image larger than it has).
+        Images not wider than the smallest variant have none, which is known from the width recorded with the original.
+        '''
+        formats = DERIVATIVE_FORMATS.get(os.path.splitext(key)[1].lstrip('.'))
+        if formats is None:
+            return(True)
+
+        entry = manifest.entries.get(bucket + '/' + key)
+        if entry is not None and entry.get('source') == source and entry.get('width') is not None and entry['width'] <= min(self.widths):
+            return(True)
+        return(manifest.is_current(derivative_key(key, min(self.widths), formats[0]), bucket, source))
+
+    def process(self, data, key, bucket, manifest, limit = None, source = None):
+        '''
+        Renders the variants of data (the original stored under key) and uploads the changed ones.
+        limit (e.g. a semaphore) bounds concurrent uploads. Returns True if all variants are up to date on S3.
+        '''
+        from .aws import upload_if_changed
+
+        formats = DERIVATIVE_FORMATS.get(os.path.splitext(key)[1].lstrip('.'))
+        if formats is None:
+            return(True)
+        if data is None:
+            return(False)
+
+        try:
+            with metrics.span('derivatives.render'):
+                (width, variants) = self.executor.submit(render_derivatives, data, self.widths, formats, self.quality).result()
+        except Exception as e:
+            if self.log is not None:
+                self.log.error('Could not render variants of {}: {}'.format(key, e))
+            return(False)
+
+        manifest.annotate(key, bucket, source, width = width)
+
+        uploaded = 0
+        for (width, format, variant) in variants:
+            metrics.count('derivatives.bytes', len(variant), format = format)
+            with (limit if limit is not None else contextlib.nullcontext()):
+                uploaded += int(upload_if_changed(variant, derivative_key(key, width, format), bucket, manifest, content_type = CONTENT_TYPES[format], source = source, log = self.log))
+
+        return(uploaded == len(variants))
+
+    def close(self):
+        self.executor.shutdown()
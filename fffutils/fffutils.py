@@ -4,11 +4,67 @@ import argparse
 import logging
 import json
 import sys
-from .actions import trello_strapi, trello_collections, local_strapi, strapi_recommendations
+import time
+import builtins
+import importlib
+import importlib.util
 
-def main():
+def command(name):
+    '''
+    Returns a function that imports the action name from actions.py only when the subcommand is run.
+    The name is kept as its action attribute.
+    '''
+    def run(args, log):
+        actions = importlib.import_module('.actions', __package__)
+        return(getattr(actions, name)(args, log))
+    run.action = name
+    return(run)
+
+def record_import_times():
+    '''
+    Records the (inclusive) import time of every module imported from now on. Returns the dict that is filled,
+    the key 'total' holds the time spent in imports overall.
+    '''
+    times = {'total': 0.0}
+    depth = [0]
+    original_import = builtins.__import__
+
+    def timed_import(name, globals = None, locals = None, fromlist = (), level = 0):
+        key = name
+        if level > 0:
+            key = importlib.util.resolve_name('.' * level + name, (globals or dict()).get('__package__') or '')
+        if key in sys.modules:
+            return(original_import(name, globals, locals, fromlist, level))
+
+        started = time.perf_counter()
+        depth[0] += 1
+        try:
+            module = original_import(name, globals, locals, fromlist, level)
+        finally:
+            depth[0] -= 1
+
+        # Only successful imports are reported
+        elapsed = time.perf_counter() - started
+        times[key] = elapsed
+        if depth[0] == 0:
+            times['total'] += elapsed
+        return(module)
+
+    builtins.__import__ = timed_import
+    return(times)
+
+def build_parser():
+    '''
+    Builds the command-line parser with all subcommands
+    '''
     parser = argparse.ArgumentParser(description='Utilities for FactsForFriends')
     parser.add_argument('--debug', action='store_true', help='Print verbose messages (for debugging)')
+    parser.add_argument('--pool-size', help='Number of keep-alive connections per host (Strapi pools grow to --in-flight)', type=int, default=None)
+    parser.add_argument('--timeout', help='Timeout in seconds for HTTP requests', type=float, default=None)
+    parser.add_argument('--retries', help='Number of retries for failed HTTP requests', type=int, default=None)
+    parser.add_argument('--import-report', help='Print the import time of every module loaded by the subcommand (JSON, to stderr)', action='store_true')
+    parser.add_argument('--metrics-out', help='File to write stage timings, request counters and latency histograms to', type=str, default=None)
+    parser.add_argument('--metrics-format', help='Format of --metrics-out (default: prometheus for *.prom files, else json)', choices=['json', 'prometheus'], default=None)
     subparsers = parser.add_subparsers()
     
     # Command-line arguments for the trello-strapi command
@@ -17,34 +73,92 @@ def main():
     parser_fetch.add_argument('--from-list', help='ID of the list containing incoming snacks', type=str, required=True)
     parser_fetch.add_argument('--move-to', help='ID of the list where processed snacks should be moved to', type=str, required=False)
     parser_fetch.add_argument('--push', help='Indicates if the fetched snacks should be pushed to the CMS.', action='store_true')
-    # parser_fetch.add_argument('--recommend-images', help='Indicates if the image recommender should be run.', action='store_true')
-    parser_fetch.set_defaults(func=trello_strapi)
+    parser_fetch.add_argument('--manifest', help='JSON file recording uploaded images, to skip unchanged uploads.', type=str, required=False)
+    parser_fetch.add_argument('--image-cache', help='Directory to cache Unsplash lookups and photos in.', type=str, required=False)
+    parser_fetch.add_argument('--image-cache-size', help='Maximum size of cached photos in MB.', type=int, default=512)
+    parser_fetch.add_argument('--state', help='SQLite file recording pushed cards, to skip unchanged cards.', type=str, required=False)
+    parser_fetch.add_argument('--full', help='Process all cards, even if they did not change since the last push.', action='store_true')
+    parser_fetch.add_argument('--workers', help='Number of cards processed concurrently.', type=int, default = 8)
+    parser_fetch.add_argument('--trello-limit', help='Maximum number of concurrent Trello requests.', type=int, default = 4)
+    parser_fetch.add_argument('--unsplash-limit', help='Maximum number of concurrent Unsplash requests.', type=int, default = 2)
+    parser_fetch.add_argument('--s3-limit', help='Maximum number of concurrent S3 uploads.', type=int, default = 8)
+    parser_fetch.add_argument('--strapi-limit', help='Maximum number of concurrent Strapi requests.', type=int, default = 4)
+    parser_fetch.add_argument('--stream-uploads', help='Pipe image downloads to S3 in parts instead of buffering them (not combined with --derivatives or --image-cache).', action='store_true')
+    parser_fetch.add_argument('--derivatives', help='Upload resized WebP/JPEG/PNG variants next to every image (requires Pillow).', action='store_true')
+    parser_fetch.add_argument('--derivative-widths', help='Widths in px of the image variants.', type=int, nargs='+', default=[480, 960, 1600])
+    parser_fetch.add_argument('--derivative-processes', help='Number of processes rendering image variants (default: number of CPUs).', type=int, default=None)
+    parser_fetch.add_argument('--recommend-images', help='Indicates if the image recommender should be run.', action='store_true')
+    parser_fetch.add_argument('--n-images', help='Number of suggested images per snack.', type=int, default=3)
+    parser_fetch.add_argument('--keywords-dir', help='Directory with the image keyword files.', type=str, default='fffutils/data')
+    parser_fetch.add_argument('--keywords-cache', help='Directory with compiled image keywords (see image-keywords).', type=str, default='fffutils/data/compiled')
+    parser_fetch.set_defaults(func=command('trello_strapi'))
 
     # Command-line arguments for the local-trello command
     parser_push = subparsers.add_parser('local-trello', help='Push local snacks to a Trello board.')
     parser_push.add_argument('--board', help='ID of the Trello board', type=str, required=True)
     parser_push.add_argument('--to-list', help='ID of the list containing incoming snacks', type=str, required=True)
-    parser_push.add_argument('--data', help='JSON data to push.', type=str, required=True)
+    parser_push.add_argument('--data', help='JSON or JSON Lines data to push (may be gzip-compressed).', type=str, required=True)
     # parser_push.set_defaults(func=push_trello)
 
     # Command-line arguments for the local-strapi command
     parser_cms = subparsers.add_parser('local-strapi', help='Push local snacks to Strapi.')
-    parser_cms.add_argument('--data', help='JSON data to push.', type=str, required=True)
-    parser_cms.set_defaults(func=local_strapi)
+    parser_cms.add_argument('--data', help='JSON or JSON Lines data to push (may be gzip-compressed).', type=str, required=True)
+    parser_cms.add_argument('--bulk', help='Push concurrently and print a throughput/latency summary.', action='store_true')
+    parser_cms.add_argument('--in-flight', help='Maximum number of concurrent requests with --bulk.', type=int, default=16)
+    parser_cms.add_argument('--snapshot', help='JSON file with the records last pushed, compared instead of the records on Strapi.', type=str, default=None)
+    parser_cms.add_argument('--full', help='Send every record as it is, without comparing to the records on Strapi.', action='store_true')
+    parser_cms.set_defaults(func=command('local_strapi'))
 
     # Command-line arguments for adding recommendations to strapi
     parser_recommendations = subparsers.add_parser('strapi-recommendations', help='Add recommendations for each fact to Strapi.')
     parser_recommendations.add_argument('--n', help = 'Number of recommendations to add', type=int, default = 3)
-    parser_recommendations.set_defaults(func=strapi_recommendations)
+    parser_recommendations.add_argument('--engine', help = 'Similarity of facts: spaCy vectors or sparse TF-IDF/BM25 term weights (no spaCy needed)', choices = ['spacy', 'tfidf', 'bm25'], default = 'spacy')
+    parser_recommendations.add_argument('--batch-size', help = 'Number of facts per spaCy batch', type=int, default = 256)
+    parser_recommendations.add_argument('--processes', help = 'Number of worker processes for spaCy preprocessing', type=int, default = 1)
+    parser_recommendations.add_argument('--page-size', help = 'Number of facts per download page', type=int, default = 100)
+    parser_recommendations.add_argument('--fetch-concurrency', help = 'Number of pages downloaded concurrently', type=int, default = 4)
+    parser_recommendations.add_argument('--store', help = 'Directory of a vector store to reuse vectors of unchanged facts', type=str, default = None)
+    parser_recommendations.add_argument('--index', help = 'Nearest neighbour search to use', choices = ['exact', 'ivf'], default = 'exact')
+    parser_recommendations.add_argument('--index-path', help = 'File to load/save the approximate (ivf) index', type=str, default = None)
+    parser_recommendations.add_argument('--lists', help = 'Number of clusters of a new approximate index (default: square root of the number of facts)', type=int, default = None)
+    parser_recommendations.add_argument('--nprobe', help = 'Number of clusters searched per fact by the approximate index', type=int, default = 8)
+    parser_recommendations.add_argument('--recall-report', help = 'Print the recall of the approximate index compared to exact search', action='store_true')
+    parser_recommendations.add_argument('--in-flight', help = 'Maximum number of concurrent requests when publishing', type=int, default = 8)
+    parser_recommendations.add_argument('--prune-duplicates', help = 'Delete duplicate recommendation records of a fact left by earlier runs', action='store_true')
+    parser_recommendations.set_defaults(func=command('strapi_recommendations'))
 
     # Command-line arguments for adding collections to strapi
     parser_collections = subparsers.add_parser('trello-collections', help='Add collections to Strapi.')
     parser_collections.add_argument('--board', help='ID of the Trello board', type=str, required=True)
     parser_collections.add_argument('--from-list', help='ID of the list containing incoming snacks', type=str, required=True)
-    parser_collections.set_defaults(func=trello_collections)
+    parser_collections.set_defaults(func=command('trello_collections'))
+
+    # Command-line arguments for compiling the image recommender keywords
+    parser_keywords = subparsers.add_parser('image-keywords', help='Compile the keyword patterns of the image recommender.')
+    parser_keywords.add_argument('--categories', help='Categories to compile (default: all keyword files)', type=str, nargs='+', default=None)
+    parser_keywords.add_argument('--data-dir', help='Directory with the keyword files', type=str, default='fffutils/data')
+    parser_keywords.add_argument('--cache-dir', help='Directory to store compiled keywords in', type=str, default='fffutils/data/compiled')
+    parser_keywords.set_defaults(func=command('image_keywords'))
 
+    # Command-line arguments for the long-running worker
+    parser_serve = subparsers.add_parser('serve', help='Run a worker that keeps models and clients loaded and accepts jobs over HTTP.')
+    parser_serve.add_argument('--host', help='Address to listen on', type=str, default='127.0.0.1')
+    parser_serve.add_argument('--port', help='Port to listen on', type=int, default=8642)
+    parser_serve.add_argument('--socket', help='Unix socket to listen on instead of host/port', type=str, default=None)
+    parser_serve.add_argument('--store', help='Directory of a vector store for the fact corpus', type=str, default=None)
+    parser_serve.add_argument('--keywords-dir', help='Directory with the image keyword files', type=str, default='fffutils/data')
+    parser_serve.add_argument('--keywords-cache', help='Directory with compiled image keywords (see image-keywords)', type=str, default='fffutils/data/compiled')
+    parser_serve.set_defaults(func=command('serve'))
+
+    return(parser)
+
+def main():
+    parser = build_parser()
     args = parser.parse_args()
 
+    if args.import_report:
+        import_times = record_import_times()
+
     # Add command-line logging
     logger = logging.getLogger(__name__)
     formatter = logging.Formatter('%(levelname)s - %(message)s')
@@ -58,9 +172,20 @@ def main():
     else:
         logger.setLevel(logging.WARNING)
 
+    # Settings for the shared HTTP clients
+    if args.pool_size is not None or args.timeout is not None or args.retries is not None:
+        from .client import configure
+        configure(pool_size = args.pool_size, timeout = args.timeout, retries = args.retries)
+
     # Dispatch function call   
+    if not hasattr(args, 'func'):
+        parser.print_help(sys.stderr)
+        sys.exit(1)
     try:
         res = args.func(args, logger)
-    except AttributeError:
-        parser.print_help(sys.stderr)
-        sys.exit(1)
\ No newline at end of file
+    finally:
+        if args.import_report:
+            print(json.dumps(dict(sorted(import_times.items(), key = lambda x: x[1], reverse = True))), file = sys.stderr)
+        if args.metrics_out is not None:
+            from . import metrics
+            metrics.write(args.metrics_out, format = args.metrics_format)
\ No newline at end of file
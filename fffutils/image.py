@@ -1,55 +1,128 @@
+import os
+import json
+import hashlib
 from collections import Counter
-import spacy
+from spacy.tokens import DocBin
 from spacy.matcher import PhraseMatcher
 from spacy.lang.de.stop_words import STOP_WORDS
 
+from . import text as text_prep
+from .nlp import model_key
+
+# Pipeline components the image recommender does not need (matching uses lemmas)
+IMAGE_DISABLE = ['parser', 'ner']
+
+def normalize_image_text(text):
+    '''
+    Lower-cases a text and removes (spaCy's) stop words before matching keywords
+    '''
+    return(text_prep.normalize_image_text(text, STOP_WORDS))
+
 def recommend_images(text, matcher, nlp, n):
-    
-    # Consolidate text into words
-    words = [word.lower() for word in text.replace("Falsch:", "").replace("-", " ").split(" ")]
-
-    # Remove stop words
-    words = [word for word in words if word not in STOP_WORDS]
-
-    tokens = nlp(" ".join(words))
-    matches = matcher(tokens)
-
-    # Dict with votes per pattern
-    votes = dict()
-    for (id, start, end) in matches:
-        name = nlp.vocab.strings[id]
-        if name not in votes.keys():
-            votes[name] = 0
-        votes[name] = votes[name] + 1
-     
-    # return top n patterns
-    vc = Counter(votes)
-    return([name for (name, count) in vc.most_common()[:n]])
-
-def load_keywords(categories, nlp, log = None):
+    return(recommend_images_batch([text], matcher, nlp, n)[0])
+
+def recommend_images_batch(texts, matcher, nlp, n, categories = None, batch_size = 64):
+    '''
+    Returns the top n image ids for each text. matcher is a PhraseMatcher or a dict of matchers per category (see
+    load_keyword_matcher). With categories (one per text), only the matcher of that category is used if it exists.
+    '''
+    if not isinstance(matcher, dict):
+        matcher = {None: matcher}
+    if categories is None:
+        categories = [None] * len(texts)
+
+    results = list()
+    docs = nlp.pipe(text_prep.normalize_image_texts(texts, STOP_WORDS), batch_size = batch_size)
+    for (doc, category) in zip(docs, categories):
+        category = category.lower() if category is not None else None
+        matchers = [matcher[category]] if category in matcher else list(matcher.values())
+
+        # Votes per pattern
+        votes = Counter()
+        for m in matchers:
+            for (id, start, end) in m(doc):
+                votes[nlp.vocab.strings[id]] += 1
+
+        # return top n patterns
+        results.append([name for (name, count) in votes.most_common(n)])
+    return(results)
+
+def keyword_categories(data_dir = 'fffutils/data'):
+    '''
+    Lists the categories with a keyword file in data_dir
+    '''
+    return(sorted(f[:-len('-keywords.txt')] for f in os.listdir(data_dir) if f.endswith('-keywords.txt')))
+
+def read_keyword_file(category, data_dir = 'fffutils/data'):
+    '''
+    Reads the image ids and keywords of a category. Returns the list of (id, keywords) and a hash of the file.
+    '''
+    with open(os.path.join(data_dir, '{}-keywords.txt'.format(category)), 'rb') as f:
+        content = f.read()
+
+    images = list()
+    for image in content.decode('utf-8').splitlines():
+        if image.strip() == '':
+            continue
+        (id, keywords) = image.split("\t")
+        images.append((id, keywords.rstrip().lower().split(",")))
+    return((images, hashlib.sha1(content).hexdigest()))
+
+def load_keywords(categories, nlp, data_dir = 'fffutils/data', cache_dir = None, log = None):
+    '''
+    Loads the keyword patterns per category. With cache_dir, patterns are compiled once, stored as DocBin and reloaded
+    as long as the keyword file, spaCy and the model did not change.
+    '''
+    model = model_key(nlp = nlp)
+    manifest = dict()
+    if cache_dir is not None:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        try:
+            with open(os.path.join(cache_dir, 'manifest.json'), 'r') as f:
+                manifest = json.load(f)
+        except (IOError, ValueError):
+            manifest = dict()
+
     keyword_dict = dict()
     for category in categories:
-        # Add category to dict
-        if category not in keyword_dict.keys():
-            keyword_dict[category] = list()
-        
-        # Read in keywords
-        with open('fffutils/data/{}-keywords.txt'.format(category)) as f:
-            for image in f:
-                (id, keywords) = image.split("\t")
-
-                pattern = list(nlp.pipe(keywords.rstrip().lower().split(",")))
-                d = {
-                    'name': id,
-                    'keywords': pattern
-                }
-                keyword_dict[category].append(d) 
+        (images, digest) = read_keyword_file(category, data_dir)
+        entry = manifest.get(category)
+        docbin_file = os.path.join(cache_dir, '{}.spacy'.format(category)) if cache_dir is not None else None
+
+        if entry is not None and entry['hash'] == digest and entry['model'] == model and os.path.exists(docbin_file):
+            if log is not None:
+                log.debug('Loading compiled keywords for category {}'.format(category))
+            docs = list(DocBin().from_disk(docbin_file).get_docs(nlp.vocab))
+        else:
+            if log is not None:
+                log.debug('Compiling keywords for category {}'.format(category))
+            # One pass over all keywords of the category
+            docs = list(nlp.pipe([keyword for (id, keywords) in images for keyword in keywords]))
+            if cache_dir is not None:
+                DocBin(attrs = ['ORTH', 'LEMMA'], docs = docs).to_disk(docbin_file)
+                manifest[category] = {'hash': digest, 'model': model}
+
+        # Split the flat list of docs into patterns per image
+        keyword_dict[category] = list()
+        start = 0
+        for (id, keywords) in images:
+            keyword_dict[category].append({
+                'name': id,
+                'keywords': docs[start:start + len(keywords)]
+            })
+            start = start + len(keywords)
+
+    if cache_dir is not None:
+        with open(os.path.join(cache_dir, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f)
+
     return(keyword_dict)
 
 def load_keyword_matcher(keyword_dict, nlp, log = None):
     category_matcher = dict()
     for (category,images) in keyword_dict.items():
         category_matcher[category] = PhraseMatcher(nlp.vocab, attr="LEMMA")
-        for i, image in enumerate(images):
-            category_matcher[category].add(str(i), None, *image["keywords"])
-    return(category_matcher)
\ No newline at end of file
+        for image in images:
+            category_matcher[category].add(image["name"], image["keywords"])
+    return(category_matcher)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+import numpy as np
+import scipy.sparse as sp
+
+from .text import recommender_text, recommender_tokens
+
+# Term weightings of the lexical recommender
+WEIGHTINGS = ('tfidf', 'bm25')
+
+def count_matrix(token_lists):
+    '''
+    Returns a sparse (documents x terms) matrix of term counts and the vocabulary (term -> column)
+    '''
+    vocabulary = dict()
+    indices = list()
+    indptr = [0]
+    for tokens in token_lists:
+        for token in tokens:
+            indices.append(vocabulary.setdefault(token, len(vocabulary)))
+        indptr.append(len(indices))
+
+    counts = sp.csr_matrix(
+        (np.ones(len(indices), dtype = np.float32), np.asarray(indices, dtype = np.int64), np.asarray(indptr, dtype = np.int64)),
+        shape = (len(indptr) - 1, len(vocabulary)))
+    counts.sum_duplicates()
+    return((counts, vocabulary))
+
+def normalize_sparse_rows(matrix):
+    '''
+    Scales every row of a sparse matrix to unit length (empty rows stay empty)
+    '''
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis = 1)).ravel())
+    norms[norms == 0] = 1
+    return(sp.diags(1 / norms).dot(matrix).tocsr().astype(np.float32))
+
+def tfidf_matrix(counts):
+    '''
+    Returns row-normalized TF-IDF weights (sublinear term frequency, smoothed idf) of a count matrix
+    '''
+    n = counts.shape[0]
+    df = np.bincount(counts.indices, minlength = counts.shape[1])
+    idf = np.log((1 + n) / (1 + df)) + 1
+
+    weights = counts.copy()
+    weights.data = (1 + np.log(weights.data)) * idf[weights.indices]
+    return(normalize_sparse_rows(weights))
+
+def bm25_matrix(counts, k1 = 1.2, b = 0.75):
+    '''
+    Returns the Okapi BM25 weights of every term in every document of a count matrix
+    '''
+    n = counts.shape[0]
+    df = np.bincount(counts.indices, minlength = counts.shape[1])
+    idf = np.log(1 + (n - df + 0.5) / (df + 0.5))
+
+    lengths = np.asarray(counts.sum(axis = 1)).ravel()
+    average = lengths.mean() if n > 0 and lengths.mean() > 0 else 1.0
+    rows = np.repeat(np.arange(n), np.diff(counts.indptr))
+
+    weights = counts.copy()
+    tf = weights.data
+    weights.data = (idf[weights.indices] * tf * (k1 + 1) / (tf + k1 * (1 - b + b * lengths[rows] / average))).astype(np.float32)
+    return(weights.tocsr())
+
+def lexical_matrices(facts, weighting = 'tfidf', log = None):
+    '''
+    Builds the sparse matrices of the lexical recommender over headline + first sentence of facts. Returns the query
+    and document matrices: a fact's neighbours are the columns with the highest scores of its row in queries @ documents.T.
+    With tfidf both are the same row-normalized matrix (cosine similarity), with bm25 every term of a fact queries the
+    BM25 weights of the other facts.
+    '''
+    if weighting not in WEIGHTINGS:
+        raise ValueError('Unknown weighting {}'.format(weighting))
+
+    (counts, vocabulary) = count_matrix(recommender_tokens(recommender_text(d, ' ')) for d in facts)
+    if log is not None:
+        log.debug('Built {} x {} term matrix with {} entries'.format(counts.shape[0], len(vocabulary), counts.nnz))
+
+    if weighting == 'tfidf':
+        matrix = tfidf_matrix(counts)
+        return((matrix, matrix))
+
+    queries = counts.copy()
+    queries.data = np.ones_like(queries.data)
+    return((queries.tocsr(), bm25_matrix(counts)))
+
+# Share of non-zero scores above which a block is ranked as dense array
+DENSE_SHARE = 0.25
+
+def top_dense(scores, offset, n):
+    '''
+    Returns the indices of the n best positive scores per row of a dense block whose rows start at offset,
+    excluding each row's own column, padded with -1. Overwrites the block.
+    '''
+    rows = np.arange(scores.shape[0])
+    scores[rows, rows + offset] = 0
+
+    # Negated in place to rank ascending without a copy of the block
+    np.negative(scores, out = scores)
+    scores[scores >= 0] = np.inf
+
+    # A corpus smaller than n leaves the last columns at -1
+    result = np.full((scores.shape[0], n), -1, dtype = np.int64)
+    k = min(n, scores.shape[1])
+    top = np.argpartition(scores, k - 1, axis = 1)[:, :k]
+    values = np.take_along_axis(scores, top, axis = 1)
+
+    # Best scores first, ties by position
+    order = np.lexsort((top, values))
+    top = np.take_along_axis(top, order, axis = 1)
+    top[np.take_along_axis(values, order, axis = 1) == np.inf] = -1
+    result[:, :k] = top
+    return(result)
+
+def find_all_similar_docs(queries, documents, n = 3, block_size = 512, log = None):
+    '''
+    Returns for every row of queries the indices of the n best scoring rows of documents (except the same row),
+    ordered by score. Rows are scored block_size at a time with sparse products, so memory stays bounded by the
+    non-zero scores of one block. Rows with fewer than n matching documents are padded with -1.
+    '''
+    count = queries.shape[0]
+    neighbours = np.full((count, n), -1, dtype = np.int64)
+    documents_t = documents.T.tocsr()
+    documents_c = documents.tocsc()
+
+    # Number of documents per term, bounds the number of non-zero scores of a query
+    df = np.diff(documents_c.indptr)
+
+    for start in range(0, count, block_size):
+        end = min(start + block_size, count)
+        block = queries[start:end]
+
+        # Blocks with many matches are scored and ranked as dense array, in about the memory of their sparse scores.
+        # Only the columns of terms in the block are multiplied.
+        if df[block.indices].sum() > DENSE_SHARE * block.shape[0] * documents.shape[0]:
+            terms = np.unique(block.indices)
+            scores = np.ascontiguousarray((documents_c[:, terms] @ block[:, terms].T.toarray()).T)
+            neighbours[start:end] = top_dense(scores, start, n)
+            continue
+
+        scores = (block @ documents_t).tocsr()
+        for row in range(end - start):
+            (lo, hi) = (scores.indptr[row], scores.indptr[row + 1])
+            indices = scores.indices[lo:hi]
+            values = scores.data[lo:hi]
+
+            # A document does not recommend itself
+            keep = (indices != start + row) & (values > 0)
+            (indices, values) = (indices[keep], values[keep])
+            if len(indices) > n:
+                top = np.argpartition(-values, n - 1)[:n]
+                (indices, values) = (indices[top], values[top])
+
+            # Best scores first, ties by position
+            order = np.lexsort((indices, -values))
+            neighbours[start + row, :len(order)] = indices[order]
+
+        if log is not None:
+            log.debug('Scored {} of {} facts'.format(end, count))
+
+    return(neighbours)
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+import os
+import json
+import time
+import functools
+import threading
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_lock = threading.Lock()
+_counters = dict()
+_histograms = dict()
+
+def key(name, labels):
+    return((name, tuple(sorted(labels.items()))))
+
+def count(name, value = 1, **labels):
+    '''
+    Adds value to the counter name (e.g. requests, bytes, retries, errors, cache hits)
+    '''
+    k = key(name, labels)
+    with _lock:
+        _counters[k] = _counters.get(k, 0) + value
+
+def observe(name, seconds, **labels):
+    '''
+    Records a duration in the latency histogram name
+    '''
+    k = key(name, labels)
+    with _lock:
+        histogram = _histograms.get(k)
+        if histogram is None:
+            histogram = {'buckets': [0] * len(BUCKETS), 'count': 0, 'sum': 0.0, 'min': None, 'max': None}
+            _histograms[k] = histogram
+        for (i, bound) in enumerate(BUCKETS):
+            if seconds <= bound:
+                histogram['buckets'][i] += 1
+                break
+        histogram['count'] += 1
+        histogram['sum'] += seconds
+        histogram['min'] = seconds if histogram['min'] is None else min(histogram['min'], seconds)
+        histogram['max'] = seconds if histogram['max'] is None else max(histogram['max'], seconds)
+
+@contextmanager
+def span(name, **labels):
+    '''
+    Times the enclosed block as a stage or external call. Exceptions are counted as errors of the stage.
+    '''
+    started = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        count('errors', stage = name, **labels)
+        raise
+    finally:
+        observe(name, time.perf_counter() - started, **labels)
+
+def timed(name, **labels):
+    '''
+    Decorator that runs the function inside span(name)
+    '''
+    def decorator(f):
+        @functools.wraps(f)
+        def wrapper(*args, **kwargs):
+            with span(name, **labels):
+                return(f(*args, **kwargs))
+        return(wrapper)
+    return(decorator)
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+def snapshot():
+    '''
+    Returns all counters and histograms as a JSON-compatible dict
+    '''
+    with _lock:
+        return({
+            'buckets': list(BUCKETS),
+            'counters': [{'name': name, 'labels': dict(labels), 'value': value} for ((name, labels), value) in sorted(_counters.items())],
+            'histograms': [dict(h, name = name, labels = dict(labels), buckets = list(h['buckets'])) for ((name, labels), h) in sorted(_histograms.items())]
+        })
+
+def prometheus_name(name, suffix):
+    return('fffutils_' + ''.join(c if c.isalnum() else '_' for c in name) + suffix)
+
+def prometheus_labels(labels, extra = None):
+    labels = dict(labels)
+    if extra is not None:
+        labels.update(extra)
+    if len(labels) == 0:
+        return('')
+    return('{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for (k, v) in sorted(labels.items())) + '}')
+
+def prometheus():
+    '''
+    Returns all metrics in the Prometheus text exposition format (for the node exporter textfile collector)
+    '''
+    data = snapshot()
+    lines = list()
+    seen = set()
+
+    for c in data['counters']:
+        metric = prometheus_name(c['name'], '_total')
+        if metric not in seen:
+            lines.append('# TYPE {} counter'.format(metric))
+            seen.add(metric)
+        lines.append('{}{} {}'.format(metric, prometheus_labels(c['labels']), c['value']))
+
+    for h in data['histograms']:
+        metric = prometheus_name(h['name'], '_seconds')
+        if metric not in seen:
+            lines.append('# TYPE {} histogram'.format(metric))
+            seen.add(metric)
+        cumulative = 0
+        for (bound, n) in zip(BUCKETS, h['buckets']):
+            cumulative += n
+            lines.append('{}_bucket{} {}'.format(metric, prometheus_labels(h['labels'], {'le': bound}), cumulative))
+        lines.append('{}_bucket{} {}'.format(metric, prometheus_labels(h['labels'], {'le': '+Inf'}), h['count']))
+        lines.append('{}_sum{} {}'.format(metric, prometheus_labels(h['labels']), h['sum']))
+        lines.append('{}_count{} {}'.format(metric, prometheus_labels(h['labels']), h['count']))
+
+    return('\n'.join(lines) + '\n')
+
+def write(path, format = None):
+    '''
+    Writes all metrics to path, as Prometheus textfile if format is 'prometheus' or path ends with .prom, else as JSON
+    '''
+    if format is None:
+        format = 'prometheus' if path.endswith('.prom') else 'json'
+
+    with open(path + '.tmp', 'w') as f:
+        if format == 'prometheus':
+            f.write(prometheus())
+        else:
+            json.dump(snapshot(), f, indent = 2)
+
+    # Replace at once, so collectors never read a partial file
+    os.replace(path + '.tmp', path)
@@ -2,18 +2,139 @@
 
 import numpy as np
 
+from .text import recommender_text, normalize_recommender_texts
+
+# Part-of-speech tags kept for the fact recommender
+RECOMMENDER_POS = ('NOUN', 'PROPN', 'ADJ')
+
+# Pipeline components the fact recommender does not need
+RECOMMENDER_DISABLE = ['parser', 'ner', 'lemmatizer']
+
 def find_similar_docs(text, corpus, n = 3, log = None):
     '''
-    Take a text (doc) and a corpus of other texts (docs) and return the indices of the n most similar items from corpus
+    Take a text (doc) and a corpus of other texts (docs) and return the indices of the n most similar items from corpus.
+    text and corpus may also be a vector and a row-normalized matrix, e.g. from a VectorStore.
     '''
-    similarities = list()
-
     if log is not None:
         log.debug('Finding similar docs for {}'.format(text))
 
+    if isinstance(corpus, np.ndarray):
+        vector = normalize_rows(np.atleast_2d(text))[0]
+        return(np.asarray(corpus @ vector).argsort()[-n:])
+
+    similarities = list()
     for doc in corpus:
         similarities.append(doc.similarity(text))
-    
+
     return(np.array(similarities).argsort()[-n:])
 
+def load_model(name = 'de_core_news_sm', disable = RECOMMENDER_DISABLE):
+    '''
+    Loads a spaCy model with the given components disabled
+    '''
+    import spacy
+    return(spacy.load(name, disable = disable))
+
+def model_key(name = 'de_core_news_sm', nlp = None):
+    '''
+    Identifies a spaCy model by name, model version and spaCy version, so output cached from it is rebuilt after an
+    upgrade. Without a loaded nlp, the version of the installed model package is used.
+    '''
+    import spacy
+    if nlp is not None:
+        name = '{}_{}'.format(nlp.meta.get('lang', ''), nlp.meta.get('name', ''))
+        version = nlp.meta.get('version', '')
+    else:
+        version = spacy.util.get_package_version(name) or ''
+    return('{}-{}/{}'.format(name, version, spacy.__version__))
+
+def vector_width(nlp):
+    '''
+    Returns the width of the token vectors of nlp: its static vectors if it has them, else the tok2vec output.
+    None if the model has neither.
+    '''
+    if nlp.vocab.vectors_length > 0:
+        return(nlp.vocab.vectors_length)
+    if nlp.has_pipe('tok2vec'):
+        model = nlp.get_pipe('tok2vec').model
+        if model.has_dim('nO'):
+            return(model.get_dim('nO'))
+    return(None)
+
+def preprocess_docs(texts, nlp, batch_size = 256, n_process = 1, log = None):
+    '''
+    Streams texts through nlp.pipe and keeps only recommender tokens (see RECOMMENDER_POS). Returns the kept tokens
+    per text and a row-normalized float32 matrix with the mean vector of the kept tokens per text.
+    '''
+    keywords = list()
+    vectors = list()
+
+    for (i, doc) in enumerate(nlp.pipe(texts, batch_size = batch_size, n_process = n_process)):
+        tokens = [t for t in doc if t.pos_ in RECOMMENDER_POS]
+        keywords.append(' '.join(t.text for t in tokens))
+
+        if len(tokens) > 0:
+            vectors.append(np.mean([t.vector for t in tokens], axis = 0))
+        else:
+            vectors.append(None)
+
+        if log is not None and (i + 1) % batch_size == 0:
+            log.debug('Preprocessed {} texts'.format(i + 1))
+
+    # Texts without any kept token get a zero vector. The width comes from the model, so it does not depend on
+    # which texts are in the batch.
+    width = vector_width(nlp)
+    if width is None:
+        width = max([len(v) for v in vectors if v is not None], default = 0)
+    matrix = np.zeros((len(vectors), width), dtype = np.float32)
+    for (i, v) in enumerate(vectors):
+        if v is not None:
+            matrix[i] = v
+
+    return((keywords, normalize_rows(matrix)))
+
+def embed_facts(facts, nlp, batch_size = 256, n_process = 1, log = None):
+    '''
+    Returns the row-normalized recommender vectors (headline + first sentence) of facts
+    '''
+    # Consolidate recommender text and keep only nouns, proper nouns and adjectives
+    texts = normalize_recommender_texts(map(recommender_text, facts))
+    (keywords, matrix) = preprocess_docs(texts, nlp, batch_size = batch_size, n_process = n_process, log = log)
+    return(matrix)
+
+def normalize_rows(matrix):
+    '''
+    Scales every row of matrix to unit length. All-zero rows stay zero.
+    '''
+    matrix = np.asarray(matrix, dtype = np.float32)
+    norms = np.linalg.norm(matrix, axis = 1, keepdims = True)
+    norms[norms == 0] = 1
+    return(matrix / norms)
+
+def find_all_similar_docs(matrix, n = 3, block_size = 1024, log = None):
+    '''
+    Take a row-normalized matrix (see embed_facts) and return, for every row, the indices of the n most similar
+    other rows ordered by decreasing cosine similarity. Self-matches are never returned.
+    '''
+    size = matrix.shape[0]
+    n = min(n, max(size - 1, 0))
+    result = np.zeros((size, n), dtype = np.int64)
+
+    if n == 0:
+        return(result)
+
+    for start in range(0, size, block_size):
+        end = min(start + block_size, size)
+        if log is not None:
+            log.debug('Scoring documents {} to {} of {}'.format(start, end, size))
+
+        scores = matrix[start:end] @ matrix.T
+        rows = np.arange(end - start)
+        scores[rows, rows + start] = -np.inf
+
+        # Unordered top n per row, then sort only those n
+        top = np.argpartition(-scores, n - 1, axis = 1)[:, :n]
+        order = np.argsort(-scores[rows[:, None], top], axis = 1, kind = 'stable')
+        result[start:end] = top[rows[:, None], order]
 
+    return(result)
@@ -2,9 +2,10 @@
 
 import os
 import sys
-import json
 from trello import TrelloClient
 
+from .reader import read_records
+
 def push_trello(args, log):
     # Get neccessary environmental variables
     trello_api_key = os.getenv('TRELLO_API_KEY', '')
@@ -26,43 +27,42 @@ def push_trello(args, log):
 
     # Add missing custom fields to board
 
-    with open(args.data, 'r') as json_file:
-        data = json.load(json_file)
-        for snack in data:
-            # Create the card
-            card = output_list.add_card(
-                name = snack['headline'],
-                desc = snack['snack'],
-                position = "top"
-            )
+    # Records are streamed from the file
+    for snack in read_records(args.data):
+        # Create the card
+        card = output_list.add_card(
+            name = snack['headline'],
+            desc = snack['snack'],
+            position = "top"
+        )
+
+        # Add URL attachment
+        card.attach(name = 'Source', url = snack['url'])
 
-            # Add URL attachment
-            card.attach(name = 'Source', url = snack['url'])
+        # If possible, add custom fields
+        try:
+            card.set_custom_field(snack['createdAt'], custom_fields['datum'])
+        except:
+            log.debug('Could not set custom field \'Datum\' for card {}'.format(card.name))
+            pass
 
-            # If possible, add custom fields
-            try:
-                card.set_custom_field(snack['createdAt'], custom_fields['datum'])
-            except:
-                log.debug('Could not set custom field \'Datum\' for card {}'.format(card.name))
-                pass
-            
-            try:
-                card.set_custom_field(snack['category'], custom_fields['kategorie']) 
-            except:
-                log.debug('Could not set custom field \'Kategorie\' for card {}'.format(card.name))
-                pass
+        try:
+            card.set_custom_field(snack['category'], custom_fields['kategorie']) 
+        except:
+            log.debug('Could not set custom field \'Kategorie\' for card {}'.format(card.name))
+            pass
 
-            try:
-                card.set_custom_field(snack['medium'], custom_fields['medium'])
-            except:
-                log.debug('Could not set custom field \'Medium\' for card {}'.format(card.name))
-                pass
+        try:
+            card.set_custom_field(snack['medium'], custom_fields['medium'])
+        except:
+            log.debug('Could not set custom field \'Medium\' for card {}'.format(card.name))
+            pass
 
-            try:
-                card.set_custom_field(snack['tags'], custom_fields['tags']) 
-            except:
-                log.debug('Could not set custom field \'Tags\' for card {}'.format(card.name))
-                pass
+        try:
+            card.set_custom_field(snack['tags'], custom_fields['tags']) 
+        except:
+            log.debug('Could not set custom field \'Tags\' for card {}'.format(card.name))
+            pass
 
-            log.debug('Added card {name} to list {list} on board {board}'.format(name = card.name, list = output_list.name, board = board.name))
+        log.debug('Added card {name} to list {list} on board {board}'.format(name = card.name, list = output_list.name, board = board.name))
 
@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+
+import io
+import json
+import gzip
+
+def open_data(path):
+    '''
+    Opens a (possibly gzip-compressed) text file for reading
+    '''
+    with open(path, 'rb') as f:
+        compressed = f.read(2) == b'\x1f\x8b'
+
+    if compressed:
+        return(gzip.open(path, 'rt', encoding = 'utf-8'))
+    return(io.open(path, 'r', encoding = 'utf-8'))
+
+def read_records(path, chunk_size = 65536):
+    '''
+    Yields the records of a JSON array or JSON Lines file one at a time, without loading the whole file
+    '''
+    decoder = json.JSONDecoder()
+
+    with open_data(path) as f:
+        buffer = ''
+        pos = 0
+        array = None
+        done = False
+        eof = False
+
+        while not done:
+            chunk = f.read(chunk_size)
+            eof = chunk == ''
+            buffer = buffer[pos:] + chunk
+            pos = 0
+
+            while True:
+                # Skip whitespace and, inside an array, separators
+                while pos < len(buffer) and (buffer[pos].isspace() or (array and buffer[pos] == ',')):
+                    pos += 1
+                if pos == len(buffer):
+                    break
+
+                if array is None:
+                    array = buffer[pos] == '['
+                    if array:
+                        pos += 1
+                    continue
+
+                if array and buffer[pos] == ']':
+                    done = True
+                    break
+
+                try:
+                    (record, end) = decoder.raw_decode(buffer, pos)
+                except ValueError:
+                    if eof:
+                        raise
+                    # Record continues in the next chunk
+                    break
+
+                # A record ending exactly at the buffer end may still be incomplete (e.g. a number)
+                if end == len(buffer) and not eof and not isinstance(record, (dict, list)):
+                    break
+
+                yield record
+                pos = end
+
+            if eof:
+                if array and not done:
+                    raise ValueError('Unterminated JSON array in {}'.format(path))
+                break
@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+
+import os
+import json
+import time
+import queue
+import threading
+import itertools
+import contextlib
+import socketserver
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+def jsonable(result):
+    '''
+    Returns result if it can be sent as JSON, otherwise a short summary of it
+    '''
+    try:
+        json.dumps(result)
+        return(result)
+    except (TypeError, ValueError):
+        if isinstance(result, list):
+            return({'items': len(result)})
+        return(repr(result))
+
+class Worker:
+    '''
+    Keeps the spaCy models, image matchers, fact corpus and service clients loaded, and runs queued CLI jobs
+    one after another in a background thread. Jobs use the loaded models (see models).
+
+    spaCy pipelines are not thread-safe, so each model has its own lock, held by requests and by a job for as long
+    as they use it. lock guards the corpus.
+    '''
+    def __init__(self, args, log):
+        from .nlp import load_model
+        from .image import IMAGE_DISABLE
+        from .strapi import get_client as strapi_client
+        from .unsplash import get_client as unsplash_client
+        from .aws import get_client as s3_client
+
+        self.args = args
+        self.log = log
+        self.lock = threading.Lock()
+        self.nlp_lock = threading.Lock()
+        self.image_lock = threading.Lock()
+        self.jobs = dict()
+        self.job_ids = itertools.count(1)
+        self.queue = queue.Queue()
+
+        # Models
+        self.nlp = load_model()
+        self.image_nlp = load_model(disable = IMAGE_DISABLE)
+        self.matcher = None
+        if os.path.isdir(args.keywords_dir):
+            self.load_matchers()
+
+        # Connection pools are reused by all jobs
+        strapi_client(auth = False)
+        unsplash_client()
+        s3_client()
+
+        self.facts = list()
+        self.matrix = None
+        self.positions = dict()
+        self.load_corpus()
+
+        threading.Thread(target = self.run, daemon = True).start()
+
+    def load_matchers(self):
+        from .image import keyword_categories, load_keywords, load_keyword_matcher
+
+        categories = keyword_categories(self.args.keywords_dir)
+        keyword_dict = load_keywords(categories, self.image_nlp, data_dir = self.args.keywords_dir, cache_dir = self.args.keywords_cache, log = self.log)
+        self.matcher = load_keyword_matcher(keyword_dict, self.image_nlp, log = self.log)
+
+    def load_corpus(self):
+        '''
+        Downloads all facts and their recommender vectors (through the vector store, if configured)
+        '''
+        from .strapi import iter_facts
+        from .nlp import model_key, embed_facts
+        from .vectors import VectorStore
+
+        facts = list(iter_facts(fields = ['id', '_id', 'headline', 'snack'], log = self.log))
+        with self.nlp_lock:
+            if self.args.store is not None:
+                store = VectorStore(self.args.store, model = model_key(nlp = self.nlp), log = self.log)
+                matrix = np.asarray(store.sync(facts, lambda subset: embed_facts(subset, self.nlp, log = self.log)))
+            else:
+                matrix = embed_facts(facts, self.nlp, log = self.log)
+        with self.lock:
+            (self.facts, self.matrix) = (facts, matrix)
+            self.positions = dict((d['id'], i) for (i, d) in enumerate(facts))
+
+        self.log.debug('Loaded {} facts into the corpus'.format(len(facts)))
+        return({'facts': len(facts)})
+
+    def recommend(self, fact, n = 3):
+        '''
+        Returns the n facts of the corpus most similar to fact (a dict with headline and snack)
+        '''
+        from .nlp import embed_facts
+
+        with self.nlp_lock:
+            vector = embed_facts([fact], self.nlp)[0]
+        with self.lock:
+            (facts, matrix, positions) = (self.facts, self.matrix, self.positions)
+
+        if matrix is None or len(facts) == 0:
+            return(list())
+
+        # A fact already in the corpus does not recommend itself
+        scores = matrix @ vector
+        if fact.get('id') in positions:
+            scores[positions[fact['id']]] = -np.inf
+
+        n = min(n, len(facts))
+        top = np.argpartition(-scores, n - 1)[:n]
+        top = top[np.argsort(-scores[top], kind = 'stable')]
+        return([{'id': facts[i]['id'], 'headline': facts[i]['headline'], 'score': float(scores[i])} for i in top if np.isfinite(scores[i])])
+
+    def images(self, text, category = None, n = 3):
+        from .image import recommend_images_batch
+
+        if self.matcher is None:
+            return(list())
+        with self.image_lock:
+            return(recommend_images_batch([text], self.matcher, self.image_nlp, n, categories = [category])[0])
+
+    def submit(self, argv):
+        '''
+        Queues a CLI command line (e.g. ['trello-strapi', '--board', ...]) and returns the job
+        '''
+        job = {'id': next(self.job_ids), 'argv': argv, 'status': 'queued', 'submitted': time.time()}
+        self.jobs[job['id']] = job
+        self.queue.put(job)
+        return(job)
+
+    def models(self, action):
+        '''
+        Returns the loaded models an action is run with, so jobs do not load their own, and the lock to hold
+        while the job uses them
+        '''
+        if action == 'strapi_recommendations':
+            return(({'nlp': self.nlp}, self.nlp_lock))
+        if action == 'trello_strapi' and self.matcher is not None:
+            return(({'image_models': (self.image_nlp, self.matcher)}, self.image_lock))
+        return((dict(), contextlib.nullcontext()))
+
+    def run(self):
+        from . import actions
+        from .fffutils import build_parser
+
+        parser = build_parser()
+        while True:
+            job = self.queue.get()
+            job['status'] = 'running'
+            job['started'] = time.time()
+            try:
+                if job['argv'] == ['reload-corpus']:
+                    result = self.load_corpus()
+                else:
+                    args = parser.parse_args(job['argv'])
+                    action = getattr(getattr(args, 'func', None), 'action', None)
+                    if action is None:
+                        raise ValueError('No command given')
+                    if action == 'serve':
+                        raise ValueError('Can not run serve as a job')
+                    (models, lock) = self.models(action)
+                    with lock:
+                        result = getattr(actions, action)(args, self.log, **models)
+                job['result'] = jsonable(result)
+                job['status'] = 'done'
+            except (Exception, SystemExit) as e:
+                self.log.error('Job {} failed: {}'.format(job['id'], e))
+                job['error'] = str(e)
+                job['status'] = 'failed'
+            job['finished'] = time.time()
+
+def handler(worker):
+    '''
+    Builds the request handler for worker. Endpoints:
+    POST /jobs (JSON list of CLI arguments), GET /jobs/<id>, POST /recommend, POST /images, GET /health
+    '''
+    class Handler(BaseHTTPRequestHandler):
+        def address_string(self):
+            return(str(self.client_address[0]) if isinstance(self.client_address, tuple) else 'unix')
+
+        def log_message(self, format, *args):
+            worker.log.debug('{} - {}'.format(self.address_string(), format % args))
+
+        def reply(self, status, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def read_body(self):
+            length = int(self.headers.get('Content-Length', 0))
+            return(json.loads(self.rfile.read(length) or b'null'))
+
+        def do_GET(self):
+            if self.path == '/health':
+                return(self.reply(200, {'status': 'ok', 'facts': len(worker.facts), 'queued': worker.queue.qsize()}))
+            if self.path.startswith('/jobs/'):
+                try:
+                    return(self.reply(200, worker.jobs[int(self.path[len('/jobs/'):])]))
+                except (KeyError, ValueError):
+                    return(self.reply(404, {'error': 'Unknown job'}))
+            self.reply(404, {'error': 'Unknown path'})
+
+        def do_POST(self):
+            try:
+                body = self.read_body()
+            except ValueError:
+                return(self.reply(400, {'error': 'Body is not JSON'}))
+
+            try:
+                if self.path == '/jobs':
+                    if not isinstance(body, list) or len(body) == 0:
+                        return(self.reply(400, {'error': 'Expected a list of command-line arguments'}))
+                    return(self.reply(202, worker.submit([str(x) for x in body])))
+                if self.path == '/recommend':
+                    return(self.reply(200, worker.recommend(body, n = int(body.get('n', 3)))))
+                if self.path == '/images':
+                    return(self.reply(200, worker.images(body['text'], category = body.get('category'), n = int(body.get('n', 3)))))
+            except (KeyError, TypeError, AttributeError, ValueError) as e:
+                return(self.reply(400, {'error': 'Invalid request: {}'.format(e)}))
+            except Exception as e:
+                worker.log.error('Request to {} failed: {}'.format(self.path, e))
+                return(self.reply(500, {'error': str(e)}))
+            self.reply(404, {'error': 'Unknown path'})
+
+    return(Handler)
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def serve(args, log):
+    '''
+    Loads everything once and serves jobs until interrupted
+    '''
+    worker = Worker(args, log)
+
+    if args.socket is not None:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = UnixHTTPServer(args.socket, handler(worker))
+        log.warning('Serving on unix socket {}'.format(args.socket))
+    else:
+        server = ThreadingHTTPServer((args.host, args.port), handler(worker))
+        log.warning('Serving on {}:{}'.format(args.host, args.port))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
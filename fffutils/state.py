@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+import json
+import hashlib
+import sqlite3
+import datetime
+import threading
+
+def snack_hash(d):
+    '''
+    Hashes a snack dict, ignoring its CMS id
+    '''
+    body = dict((k, v) for (k, v) in d.items() if k != '_id')
+    return(hashlib.sha1(json.dumps(body, sort_keys = True).encode('utf-8')).hexdigest())
+
+class SyncState:
+    '''
+    SQLite record of the last successful push per Trello card: last activity of the card, hash of the snack and Strapi id
+    '''
+    def __init__(self, path, log = None):
+        self.log = log
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread = False)
+        with self.lock, self.db:
+            self.db.execute('''
+                CREATE TABLE IF NOT EXISTS cards (
+                    card_id TEXT PRIMARY KEY,
+                    last_activity TEXT,
+                    snack_hash TEXT,
+                    strapi_id TEXT,
+                    synced_at TEXT
+                )''')
+
+    def get(self, card_id):
+        '''
+        Returns (last_activity, snack_hash, strapi_id) of a card, or None if it was never pushed
+        '''
+        with self.lock:
+            return(self.db.execute('SELECT last_activity, snack_hash, strapi_id FROM cards WHERE card_id = ?', (card_id, )).fetchone())
+
+    def is_unchanged(self, card_id, last_activity):
+        entry = self.get(card_id)
+        return(entry is not None and entry[0] == last_activity)
+
+    def record(self, card_id, last_activity, snack_hash, strapi_id):
+        with self.lock, self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO cards (card_id, last_activity, snack_hash, strapi_id, synced_at) VALUES (?, ?, ?, ?, ?)',
+                (card_id, last_activity, snack_hash, strapi_id, datetime.datetime.now().replace(microsecond=0).isoformat()))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -2,56 +2,326 @@
 
 import os
 import sys
-import urllib3
 import json
+import time
+import asyncio
+import datetime
+import itertools
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 
-def push(data, log = None):
-    if not isinstance(data, list): 
-        data = [data]
+from . import metrics
+from .client import Client, DEFAULTS
+from .helper import latency_summary
+
+STRAPI_URL = os.getenv('STRAPI_URL', 'https://cms.factsforfriends.de')
 
-    # Get neccessary JWT auth token
-    strapi_auth_token = os.getenv('STRAPI_AUTH_TOKEN', '')
+_client = None
+_client_lock = threading.Lock()
 
-    if strapi_auth_token == '':
+def get_client(auth = True, pool_size = None):
+    '''
+    Returns the Strapi client shared by all requests of a run. Exits if auth is required but STRAPI_AUTH_TOKEN is not set.
+    pool_size is the number of requests the caller sends concurrently: a shared client with a smaller pool is replaced,
+    so requests do not wait for a connection. Requests already sent finish on the old client.
+    '''
+    global _client
+    with _client_lock:
+        if _client is None or (pool_size is not None and _client.pool_size < pool_size):
+            # Get neccessary JWT auth token
+            strapi_auth_token = os.getenv('STRAPI_AUTH_TOKEN', '')
+            headers = {'Content-Type': 'application/json'}
+            if strapi_auth_token != '':
+                headers['Authorization'] = 'Bearer ' + strapi_auth_token
+            _client = Client('strapi', headers = headers, pool_size = max(pool_size or 0, DEFAULTS['pool_size']))
+
+    if auth and 'Authorization' not in _client.headers:
         sys.exit('Could not find Strapi JWT auth token in environment. Please set STRAPI_AUTH_TOKEN.')
-    
-    http = urllib3.PoolManager()
+    return(_client)
+
+@metrics.timed('strapi.push')
+def push(data, log = None):
+    '''
+    Pushes a snack or an iterable of snacks (e.g. a stream from reader.read_records) one after another
+    '''
+    if isinstance(data, dict):
+        data = [data]
+
+    http = get_client()
     responses = list()
 
     for d in data:
-        method = 'POST'
-        url = 'https://cms.factsforfriends.de/facts'
-        
-        # If the data has an ID, PUT instead of POST
-        id = d.pop('_id', None)
-        if id is not None and id != '':
-            method = 'PUT'
-            url = url + '/' + id
-
-        encoded_data = json.dumps(d).encode('utf-8')
+        (method, url, encoded_data) = prepare_push(d)
         
-        log.debug('Sending {} request to {} with body {}'.format(method, url, encoded_data))
+        if log is not None:
+            log.debug('Sending {} request to {} with body {}'.format(method, url, encoded_data))
 
         req = http.request(
             method,
             url,
-            body=encoded_data,
-            headers={
-                    'Content-Type': 'application/json',
-                    'Authorization': 'Bearer ' + strapi_auth_token})
+            body=encoded_data)
         responses.append(req)
     
     return(responses)
 
-def add_recommendation(fact, recommendations, log = None):
-    # Get neccessary JWT auth token
-    strapi_auth_token = os.getenv('STRAPI_AUTH_TOKEN', '')
+def prepare_push(d):
+    '''
+    Returns method, url and encoded body to push a single snack. Snacks with an _id are updated (PUT), others are created (POST).
+    '''
+    method = 'POST'
+    url = STRAPI_URL + '/facts'
 
-    if strapi_auth_token == '':
-        sys.exit('Could not find Strapi JWT auth token in environment. Please set STRAPI_AUTH_TOKEN.')
-    
-    http = urllib3.PoolManager()
-    url = 'https://cms.factsforfriends.de/recommendations'
+    # If the data has an ID, PUT instead of POST
+    body = dict(d)
+    id = body.pop('_id', None)
+    if id is not None and id != '':
+        method = 'PUT'
+        url = url + '/' + id
+
+    return((method, url, json.dumps(body).encode('utf-8')))
+
+@metrics.timed('strapi.bulk_push')
+def bulk_push(data, in_flight = 16, log = None):
+    '''
+    Pushes many snacks concurrently with at most in_flight open requests. Returns a result per snack (in input order)
+    and a summary with throughput and latency percentiles.
+    '''
+    return(asyncio.run(bulk_push_async(data, in_flight = in_flight, log = log)))
+
+async def bulk_push_async(data, in_flight = 16, log = None):
+    http = get_client(pool_size = in_flight)
+    loop = asyncio.get_event_loop()
+    executor = ThreadPoolExecutor(max_workers = in_flight)
+    semaphore = asyncio.Semaphore(in_flight)
+
+    async def send(index, d):
+        try:
+            (method, url, encoded_data) = prepare_push(d)
+            if log is not None:
+                log.debug('Sending {} request to {} with body {}'.format(method, url, encoded_data))
+
+            result = {'index': index, 'method': method, 'status': None, 'id': None, 'error': None}
+            started = time.perf_counter()
+            try:
+                res = await loop.run_in_executor(executor, lambda: http.request(method, url, body=encoded_data))
+                result['status'] = res.status
+                if res.status >= 300:
+                    result['error'] = res.data.decode('utf-8', 'replace')
+                else:
+                    result['id'] = json.loads(res.data).get('_id')
+            except Exception as e:
+                result['error'] = str(e)
+            result['latency'] = time.perf_counter() - started
+
+            if result['error'] is not None and log is not None:
+                log.error('Pushing item {} failed: {}'.format(index, result['error']))
+            return(result)
+        finally:
+            semaphore.release()
+
+    # Take items from data only when a slot is free, so streamed input is never read ahead
+    started = time.perf_counter()
+    tasks = list()
+    try:
+        for (i, d) in enumerate(data):
+            await semaphore.acquire()
+            tasks.append(asyncio.ensure_future(send(i, d)))
+        results = await asyncio.gather(*tasks)
+    finally:
+        executor.shutdown(wait = False)
+    elapsed = time.perf_counter() - started
+
+    summary = latency_summary([r['latency'] for r in results], elapsed)
+    summary['succeeded'] = len([r for r in results if r['error'] is None])
+    summary['failed'] = len(results) - summary['succeeded']
+
+    return((list(results), summary))
+
+@metrics.timed('strapi.get_facts_by')
+def get_facts_by(field, values, log = None):
+    '''
+    Fetches the facts whose field (e.g. id or slug) has one of values, in a single request
+    '''
+    http = get_client(auth = False)
+    query = urllib.parse.urlencode([(field + '_in', v) for v in values] + [('_limit', -1)])
+    url = STRAPI_URL + '/facts?' + query
+
+    if log is not None:
+        log.debug('Sending GET request to {}'.format(url))
+
+    req = http.request('GET', url)
+    if req.status != 200:
+        raise ValueError('Received status {} when fetching facts by {}'.format(req.status, field))
+    return(json.loads(req.data))
+
+# Fields compared as points in time, since Strapi returns them in another format than they are sent
+DATE_FIELDS = ('date', 'valid_through')
+
+def same_value(field, a, b):
+    '''
+    Checks if a field value sent to Strapi (a) equals the stored one (b)
+    '''
+    if a == b:
+        return(True)
+    if field in DATE_FIELDS and isinstance(a, str) and isinstance(b, str):
+        import dateutil.parser
+        try:
+            (a, b) = (dateutil.parser.isoparse(a), dateutil.parser.isoparse(b))
+        except ValueError:
+            return(False)
+        # Dates without time zone are sent as UTC
+        if a.tzinfo is None:
+            a = a.replace(tzinfo = datetime.timezone.utc)
+        if b.tzinfo is None:
+            b = b.replace(tzinfo = datetime.timezone.utc)
+        return(a == b)
+    return(False)
+
+class Upserter:
+    '''
+    Creates or updates snacks against their current records, which are fetched from Strapi in bulk (see prefetch)
+    or read from a local snapshot file. Only changed fields are sent and unchanged snacks are skipped.
+    Snacks are matched by _id, snacks without _id by slug.
+    '''
+    def __init__(self, snapshot = None, log = None):
+        self.path = snapshot
+        self.log = log
+        self.lock = threading.Lock()
+        self.records = dict()
+        self.slugs = dict()
+        self.stats = {'created': 0, 'updated': 0, 'unchanged': 0, 'failed': 0}
+
+        if snapshot is not None and os.path.exists(snapshot):
+            with open(snapshot, 'r') as f:
+                for record in json.load(f):
+                    self.remember(record)
+
+    def remember(self, record):
+        with self.lock:
+            self.records[record['_id']] = record
+            if record.get('slug', '') != '':
+                self.slugs[record['slug']] = record['_id']
+
+    def save(self):
+        if self.path is None:
+            return
+        with self.lock:
+            with open(self.path + '.tmp', 'w') as f:
+                json.dump(list(self.records.values()), f)
+        os.replace(self.path + '.tmp', self.path)
+
+    def prefetch(self, snacks, chunk_size = 50):
+        '''
+        Fetches the current records of snacks from Strapi, chunk_size records per request. Does nothing with a snapshot.
+        '''
+        if self.path is not None:
+            return
+
+        ids = set(d['_id'] for d in snacks if d.get('_id', '') != '' and d['_id'] not in self.records)
+        slugs = set(d['slug'] for d in snacks if d.get('_id', '') == '' and d.get('slug', '') != '' and d['slug'] not in self.slugs)
+        for (field, values) in [('id', sorted(ids)), ('slug', sorted(slugs))]:
+            for start in range(0, len(values), chunk_size):
+                for record in get_facts_by(field, values[start:start + chunk_size], log = self.log):
+                    self.remember(record)
+
+    def find(self, d):
+        with self.lock:
+            id = d.get('_id', '')
+            if id == '':
+                id = self.slugs.get(d.get('slug', ''), '')
+            return(self.records.get(id))
+
+    def upsert(self, d):
+        '''
+        Creates d, updates the changed fields of its record or skips it. Returns a result with action
+        (created, updated, unchanged or failed), status, id, error, the record as stored on Strapi and the latency
+        of the request (None if nothing was sent).
+        '''
+        current = self.find(d)
+        result = {'action': None, 'status': None, 'id': None, 'error': None, 'record': current, 'latency': None}
+
+        if current is None:
+            # Unknown snacks are created, or sent in full if they have an _id
+            (method, url, encoded_data) = prepare_push(d)
+            action = 'created' if method == 'POST' else 'updated'
+        else:
+            changes = dict((k, v) for (k, v) in d.items() if k != '_id' and not same_value(k, v, current.get(k)))
+            if len(changes) == 0:
+                result['action'] = 'unchanged'
+                result['id'] = current['_id']
+                with self.lock:
+                    self.stats['unchanged'] += 1
+                metrics.count('strapi.upserts', action = 'unchanged')
+                return(result)
+            changes['_id'] = current['_id']
+            (method, url, encoded_data) = prepare_push(changes)
+            action = 'updated'
+
+        if self.log is not None:
+            self.log.debug('Sending {} request to {} with body {}'.format(method, url, encoded_data))
+
+        started = time.perf_counter()
+        try:
+            res = get_client().request(method, url, body=encoded_data)
+            result['status'] = res.status
+            if res.status >= 300:
+                result['error'] = res.data.decode('utf-8', 'replace')
+            else:
+                record = dict(current or dict())
+                record.update(json.loads(res.data))
+                result['record'] = record
+                result['id'] = record['_id']
+                self.remember(record)
+        except Exception as e:
+            result['error'] = str(e)
+        result['latency'] = time.perf_counter() - started
+
+        result['action'] = action if result['error'] is None else 'failed'
+        with self.lock:
+            self.stats[result['action']] += 1
+        metrics.count('strapi.upserts', action = result['action'])
+
+        if result['error'] is not None and self.log is not None:
+            self.log.error('Upserting snack {} failed: {}'.format(d.get('headline', d.get('_id')), result['error']))
+        return(result)
+
+@metrics.timed('strapi.upsert')
+def upsert(data, upserter, batch_size = 100, in_flight = 1, log = None):
+    '''
+    Upserts a snack or an iterable of snacks (e.g. a stream from reader.read_records) with upserter (an Upserter).
+    Current records are fetched batch by batch, up to in_flight snacks of a batch are sent concurrently.
+    Returns a result per snack (in input order) and a summary with the count of each action, throughput and
+    latency percentiles of the requests sent.
+    '''
+    if isinstance(data, dict):
+        data = [data]
+
+    # The requests of the upserter share the client, sized for in_flight requests
+    get_client(pool_size = in_flight)
+
+    started = time.perf_counter()
+    data = iter(data)
+    results = list()
+    with ThreadPoolExecutor(max_workers = in_flight) as executor:
+        while True:
+            batch = list(itertools.islice(data, batch_size))
+            if len(batch) == 0:
+                break
+            upserter.prefetch(batch)
+            results.extend(executor.map(upserter.upsert, batch))
+    elapsed = time.perf_counter() - started
+
+    summary = latency_summary([r['latency'] for r in results if r['latency'] is not None], elapsed)
+    for action in ['created', 'updated', 'unchanged', 'failed']:
+        summary[action] = len([r for r in results if r['action'] == action])
+
+    return((results, summary))
+
+@metrics.timed('strapi.add_recommendation')
+def add_recommendation(fact, recommendations, log = None):
+    http = get_client()
+    url = STRAPI_URL + '/recommendations'
 
     body = dict()
     body['fact'] = fact
@@ -64,22 +334,125 @@ def add_recommendation(fact, recommendations, log = None):
     req = http.request(
             'POST',
             url,
-            body=encoded_data,
-            headers={
-                    'Content-Type': 'application/json',
-                    'Authorization': 'Bearer ' + strapi_auth_token})
+            body=encoded_data)
     
     return(req)
 
-def add_collection(name, comment, valid_through, facts, id = None, log = None):
-    # Get neccessary JWT auth token
-    strapi_auth_token = os.getenv('STRAPI_AUTH_TOKEN', '')
+def relation_id(value):
+    '''
+    Returns the id of a relation, which Strapi returns populated (as record) or as id
+    '''
+    if isinstance(value, dict):
+        return(value.get('id', value.get('_id')))
+    return(value)
 
-    if strapi_auth_token == '':
-        sys.exit('Could not find Strapi JWT auth token in environment. Please set STRAPI_AUTH_TOKEN.')
-    
-    http = urllib3.PoolManager()
-    url = 'https://cms.factsforfriends.de/collections'
+@metrics.timed('strapi.get_recommendations')
+def get_recommendations(page_size = 500, log = None):
+    '''
+    Fetches all recommendation records page by page
+    '''
+    http = get_client(auth = False)
+    records = list()
+    while True:
+        url = STRAPI_URL + '/recommendations?_sort=id:ASC&_start={}&_limit={}'.format(len(records), page_size)
+        if log is not None:
+            log.debug('Sending GET request to {}'.format(url))
+
+        req = http.request('GET', url)
+        if req.status != 200:
+            raise ValueError('Received status {} when fetching recommendations'.format(req.status))
+        page = json.loads(req.data)
+        records.extend(page)
+        if len(page) < page_size:
+            return(records)
+
+@metrics.timed('strapi.publish_recommendations')
+def publish_recommendations(recommendations, in_flight = 8, prune = False, log = None):
+    '''
+    Publishes recommendations (a list of fact id and list of recommended fact ids) idempotently: existing records are
+    updated if their list changed and skipped otherwise, only facts without a record get a new one. Up to in_flight
+    requests are sent concurrently. With prune, duplicate records of a fact (left by earlier runs) are deleted.
+    Returns a result per fact (in input order) and a summary with the counts of each action.
+    '''
+    http = get_client(pool_size = in_flight)
+    started = time.perf_counter()
+
+    # Existing records by fact, the first one of each fact is kept
+    existing = dict()
+    duplicates = list()
+    for record in get_recommendations(log = log):
+        fact = relation_id(record.get('fact'))
+        if fact in existing:
+            duplicates.append(record)
+        else:
+            existing[fact] = record
+
+    def publish(item):
+        (fact, recommends) = item
+        result = {'fact': fact, 'action': None, 'status': None, 'id': None, 'error': None}
+        record = existing.get(fact)
+
+        if record is not None:
+            result['id'] = record.get('_id', record.get('id'))
+            if [relation_id(r) for r in record.get('recommends', list())] == list(recommends):
+                result['action'] = 'unchanged'
+                return(result)
+        action = 'updated' if record is not None else 'created'
+
+        try:
+            # Ids are strings in MongoDB and integers in SQL databases
+            if record is not None:
+                (method, url, body) = ('PUT', STRAPI_URL + '/recommendations/' + str(result['id']), {'recommends': recommends})
+            else:
+                (method, url, body) = ('POST', STRAPI_URL + '/recommendations', {'fact': fact, 'recommends': recommends})
+
+            encoded_data = json.dumps(body).encode('utf-8')
+            if log is not None:
+                log.debug('Sending {} request to {} with body {}'.format(method, url, encoded_data))
+
+            res = http.request(method, url, body=encoded_data)
+            result['status'] = res.status
+            if res.status >= 300:
+                result['error'] = res.data.decode('utf-8', 'replace')
+            else:
+                response = json.loads(res.data)
+                result['id'] = response.get('_id', response.get('id'))
+        except Exception as e:
+            result['error'] = str(e)
+
+        result['action'] = action if result['error'] is None else 'failed'
+        if result['error'] is not None and log is not None:
+            log.error('Publishing recommendations for fact {} failed: {}'.format(fact, result['error']))
+        return(result)
+
+    def delete(record):
+        id = record.get('_id', record.get('id'))
+        try:
+            res = http.request('DELETE', STRAPI_URL + '/recommendations/' + str(id))
+            return(res.status < 300)
+        except Exception as e:
+            if log is not None:
+                log.error('Deleting recommendation {} failed: {}'.format(id, e))
+            return(False)
+
+    with ThreadPoolExecutor(max_workers = in_flight) as executor:
+        results = list(executor.map(publish, recommendations))
+        deleted = sum(executor.map(delete, duplicates)) if prune else 0
+
+    summary = dict((action, 0) for action in ['created', 'updated', 'unchanged', 'failed'])
+    for result in results:
+        summary[result['action']] += 1
+        metrics.count('strapi.recommendations', action = result['action'])
+    summary['duplicates'] = len(duplicates)
+    summary['deleted'] = deleted
+    summary['seconds'] = time.perf_counter() - started
+
+    return((results, summary))
+
+@metrics.timed('strapi.add_collection')
+def add_collection(name, comment, valid_through, facts, id = None, log = None):
+    http = get_client()
+    url = STRAPI_URL + '/collections'
 
     body = dict()
     body['name'] = name
@@ -100,17 +473,15 @@ def add_collection(name, comment, valid_through, facts, id = None, log = None):
     req = http.request(
             method,
             url,
-            body=encoded_data,
-            headers={
-                    'Content-Type': 'application/json',
-                    'Authorization': 'Bearer ' + strapi_auth_token})
+            body=encoded_data)
         
     return(req)
 
 
+@metrics.timed('strapi.get_facts')
 def get_facts(limit = -1, log = None):
-    http = urllib3.PoolManager()
-    req = http.request('GET', 'https://cms.factsforfriends.de/facts?_limit=' + str(limit))
+    http = get_client(auth = False)
+    req = http.request('GET', STRAPI_URL + '/facts?_limit=' + str(limit))
         
     try:
         return(json.loads(req.data))
@@ -119,3 +490,52 @@ def get_facts(limit = -1, log = None):
             log.warning('A database request returned a non-str response.')
         return(list())
             
+
+@metrics.timed('strapi.get_fact_page')
+def get_fact_page(start, limit, fields = None, log = None):
+    '''
+    Fetches one page of facts, reduced to fields if given
+    '''
+    http = get_client(auth = False)
+    url = STRAPI_URL + '/facts?_sort=id:ASC&_start={}&_limit={}'.format(start, limit)
+
+    if log is not None:
+        log.debug('Sending GET request to {}'.format(url))
+
+    req = http.request('GET', url)
+    if req.status != 200:
+        raise ValueError('Received status {} when fetching facts {} to {}'.format(req.status, start, start + limit))
+    page = json.loads(req.data)
+
+    if fields is not None:
+        page = [dict((f, d[f]) for f in fields if f in d) for d in page]
+    return(page)
+
+def iter_facts(page_size = 100, concurrency = 4, fields = None, log = None):
+    '''
+    Yields all facts page by page (in order) while up to concurrency pages are downloaded in the background.
+    Strapi returns whole records, fields only limits what is kept in memory.
+    '''
+    get_client(auth = False, pool_size = concurrency)
+    with ThreadPoolExecutor(max_workers = concurrency) as executor:
+        pending = dict()
+        for next_page in range(concurrency):
+            pending[next_page] = executor.submit(get_fact_page, next_page * page_size, page_size, fields, log)
+        next_page = concurrency
+
+        page = 0
+        while page in pending:
+            facts = pending.pop(page).result()
+            metrics.count('strapi.facts_fetched', len(facts))
+            for fact in facts:
+                yield fact
+
+            # A short page is the last one
+            if len(facts) < page_size:
+                for future in pending.values():
+                    future.cancel()
+                return
+
+            pending[next_page] = executor.submit(get_fact_page, next_page * page_size, page_size, fields, log)
+            next_page += 1
+            page += 1
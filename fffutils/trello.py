@@ -3,8 +3,12 @@
 import os
 import sys
 import json
-from trello import TrelloClient
+from trello import TrelloClient, Card
+from trello.customfield import CustomFieldDefinition
 
+from . import metrics
+
+@metrics.timed('trello.connect_board')
 def connect_board(id, log=None):
     '''
     Connects to a Trello board with ID id
@@ -19,10 +23,36 @@ def connect_board(id, log=None):
         sys.exit(1)
 
     # Create connection to Trello
-    client = TrelloClient(api_key = trello_api_key, api_secret = trello_api_secret)
+    # TRELLO_API_URL sends requests to another Trello-compatible API
+    client = TrelloClient(api_key = trello_api_key, api_secret = trello_api_secret, http_service = TrelloService(os.getenv('TRELLO_API_URL', '')))
 
     return(client.get_board(id))
 
+class TrelloService:
+    '''
+    Stand-in for the requests module used by py-trello, which reports every request to metrics
+    and rewrites the Trello API base URL if base_url is given
+    '''
+    def __init__(self, base_url = ''):
+        self.base_url = base_url.rstrip('/')
+
+    def request(self, method, url, **kwargs):
+        import requests
+        if self.base_url != '':
+            url = url.replace('https://api.trello.com/1', self.base_url, 1)
+
+        with metrics.span('http.request', service = 'trello'):
+            r = requests.request(method, url, **kwargs)
+        metrics.count('http.requests', service = 'trello', status = '{}xx'.format(r.status_code // 100))
+        metrics.count('http.bytes_received', len(r.content), service = 'trello')
+        return(r)
+
+def fetch_last_activity(card):
+    '''
+    Reads the last activity of a card from Trello, e.g. after the card was updated
+    '''
+    return(card.client.fetch_json('/cards/' + card.id, query_params = {'fields': 'dateLastActivity'}).get('dateLastActivity'))
+
 def get_custom_field_value(name, fields, default='', log=None):
     '''
     Helper function to obtain the value of a custom field
@@ -35,12 +65,12 @@ def get_custom_field_value(name, fields, default='', log=None):
         return(default)
     return(val.rstrip())
 
-def extract_attachments(card):
+def extract_attachments(card, snapshot = None):
     '''
-    Helper function to extract URLs and images from a cards attachments
+    Helper function to extract URLs and images from a cards attachments. Reads from snapshot (a BoardSnapshot) if given.
     '''
     attachments = list()
-    for attachment in card.attachments:
+    for attachment in (snapshot.attachments(card.id) if snapshot is not None else card.attachments):
         attachment_type = ''
         if attachment['url'].startswith('http'):
             if attachment['name'].endswith('.png'):
@@ -48,7 +78,76 @@ def extract_attachments(card):
             else:
                 attachment_type = 'source'
         
-        if attachment_type is not '':
+        if attachment_type != '':
             attachments.append({'type': attachment_type, 'url': attachment['url']})
     
     return(attachments)
+
+class BoardSnapshot:
+    '''
+    All open cards of a board with attachments and custom field values, loaded in a few bulk requests
+    '''
+    def __init__(self, board, log = None):
+        with metrics.span('trello.snapshot'):
+            self.load(board, log)
+
+    def load(self, board, log = None):
+        self.board = board
+
+        # Custom field definitions, indexed by id
+        definitions = board.client.fetch_json('/boards/' + board.id + '/customFields')
+        self.field_definitions = [CustomFieldDefinition.from_json(board, d) for d in definitions]
+        self.definitions = dict((d['id'], d) for d in definitions)
+
+        # Cards with attachments and custom field items
+        cards = board.client.fetch_json(
+            '/boards/' + board.id + '/cards',
+            query_params = {'filter': 'open', 'attachments': 'true', 'customFieldItems': 'true'})
+
+        self.cards = dict()
+        self.lists = dict()
+        for card in cards:
+            self.cards[card['id']] = card
+            self.lists.setdefault(card['idList'], list()).append(card['id'])
+
+        if log is not None:
+            log.debug('Loaded {} cards in {} lists from board {}'.format(len(self.cards), len(self.lists), board.id))
+
+    def list_cards(self, list_id):
+        '''
+        Returns py-trello cards of a list in their order on the board, without triggering further requests for their
+        custom fields
+        '''
+        cards = list()
+        for card_id in sorted(self.lists.get(list_id, list()), key = lambda id: self.cards[id].get('pos', 0)):
+            json_obj = dict(self.cards[card_id])
+            json_obj.pop('customFieldItems', None)
+            cards.append(Card.from_json(self.board, json_obj))
+        return(cards)
+
+    def last_activity(self, card_id):
+        return(self.cards[card_id].get('dateLastActivity'))
+
+    def attachments(self, card_id):
+        return(self.cards[card_id].get('attachments', list()))
+
+    def custom_fields(self, card_id):
+        '''
+        Returns the custom field values of a card by lower-case field name
+        '''
+        fields = dict()
+        for item in self.cards[card_id].get('customFieldItems', list()):
+            definition = self.definitions.get(item['idCustomField'])
+            if definition is None:
+                continue
+
+            if definition['type'] == 'list':
+                options = dict((o['id'], o['value']['text']) for o in definition.get('options', list()))
+                value = options.get(item.get('idValue'), '')
+            else:
+                value = item.get('value', dict()).get(definition['type'], '')
+                if definition['type'] == 'checkbox':
+                    value = value == 'true'
+
+            fields[definition['name'].lower()] = value
+        return(fields)
@@ -2,21 +2,135 @@
 
 import os
 import json
-import urllib3
+import time
+import hashlib
+import threading
 
-def retrieve_url(id, size, log = None):
+from . import metrics
+from .client import Client
+
+UNSPLASH_API_URL = os.getenv('UNSPLASH_API_URL', 'https://api.unsplash.com')
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    '''
+    Returns the HTTP client shared by all Unsplash lookups and photo downloads of a run
+    '''
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = Client('unsplash')
+    return(_client)
+
+class PhotoCache:
+    '''
+    Persistent cache for Unsplash photo URLs (per photo id, expiring after ttl seconds) and downloaded photos.
+    Photos are evicted least recently used first once they take more than max_bytes.
+    '''
+    def __init__(self, path, max_bytes = 512 * 1024 * 1024, ttl = 7 * 24 * 3600, log = None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.log = log
+        self.lock = threading.Lock()
+        self.stats = {'url_hits': 0, 'url_misses': 0, 'photo_hits': 0, 'photo_misses': 0, 'evicted': 0}
+
+        if not os.path.isdir(os.path.join(path, 'photos')):
+            os.makedirs(os.path.join(path, 'photos'))
+
+        try:
+            with open(self.index_file(), 'r') as f:
+                index = json.load(f)
+            self.urls = index['urls']
+            self.photos = index['photos']
+        except (IOError, ValueError, KeyError):
+            self.urls = dict()
+            self.photos = dict()
+
+    def index_file(self):
+        return(os.path.join(self.path, 'index.json'))
+
+    def photo_file(self, url):
+        return(os.path.join(self.path, 'photos', hashlib.sha1(url.encode('utf-8')).hexdigest()))
+
+    def get_url(self, id, size):
+        with self.lock:
+            entry = self.urls.get(id)
+            if entry is not None and time.time() - entry['fetched'] < self.ttl and size in entry['urls']:
+                self.stats['url_hits'] += 1
+                metrics.count('cache.hits', cache = 'unsplash_url')
+                return(entry['urls'][size])
+            self.stats['url_misses'] += 1
+            metrics.count('cache.misses', cache = 'unsplash_url')
+            return(None)
+
+    def put_urls(self, id, urls):
+        with self.lock:
+            self.urls[id] = {'urls': urls, 'fetched': time.time()}
+
+    def get_photo(self, url):
+        with self.lock:
+            entry = self.photos.get(url)
+            if entry is not None:
+                try:
+                    with open(self.photo_file(url), 'rb') as f:
+                        data = f.read()
+                    entry['used'] = time.time()
+                    self.stats['photo_hits'] += 1
+                    metrics.count('cache.hits', cache = 'unsplash_photo')
+                    return(data)
+                except IOError:
+                    del self.photos[url]
+            self.stats['photo_misses'] += 1
+            metrics.count('cache.misses', cache = 'unsplash_photo')
+            return(None)
+
+    def put_photo(self, url, data):
+        with self.lock:
+            with open(self.photo_file(url), 'wb') as f:
+                f.write(data)
+            self.photos[url] = {'size': len(data), 'used': time.time()}
+
+            # Evict least recently used photos above the size cap
+            total = sum(e['size'] for e in self.photos.values())
+            for old in sorted(self.photos, key = lambda u: self.photos[u]['used']):
+                if total <= self.max_bytes:
+                    break
+                total -= self.photos.pop(old)['size']
+                self.stats['evicted'] += 1
+                metrics.count('cache.evicted', cache = 'unsplash_photo')
+                try:
+                    os.remove(self.photo_file(old))
+                except OSError:
+                    pass
+
+    def save(self):
+        with self.lock:
+            with open(self.index_file() + '.tmp', 'w') as f:
+                json.dump({'urls': self.urls, 'photos': self.photos}, f)
+            os.replace(self.index_file() + '.tmp', self.index_file())
+
+@metrics.timed('unsplash.retrieve_url')
+def retrieve_url(id, size, log = None, cache = None):
     '''
-    Retrieves the URL for the Photo with given ID and size.
+    Retrieves the URL for the Photo with given ID and size. Uses cache (a PhotoCache) if given.
     '''
+    if cache is not None:
+        url = cache.get_url(id, size)
+        if url is not None:
+            return(url)
 
     # Get neccessary auth token
     unsplash_access_key = os.getenv('UNSPLASH_ACCESS_KEY', '')
     #unsplash_secret_key = os.getenv('UNSPLASH_SECRET_KEY', '')
 
-    http = urllib3.PoolManager()
+    http = get_client()
+    data = dict()
     try:
         r = http.request('GET', 
-            'https://api.unsplash.com/photos/{}?client_id={}'.format(id, unsplash_access_key),
+            UNSPLASH_API_URL + '/photos/{}?client_id={}'.format(id, unsplash_access_key),
             )
         data = json.loads(r.data.decode('utf-8'))
     except Exception as e:
@@ -25,6 +139,8 @@ def retrieve_url(id, size, log = None):
         pass
     
     if 'urls' in data:
+        if cache is not None:
+            cache.put_urls(id, data['urls'])
         if size in data['urls']:
             return(data['urls'][size])
         else:
@@ -33,17 +149,65 @@ def retrieve_url(id, size, log = None):
             return(None)
     return(None)
 
-def get_binary_photo(url, headers = None, log = None):
+@metrics.timed('unsplash.get_binary_photo')
+def get_binary_photo(url, headers = None, log = None, cache = None):
     '''
-    Retrieves a binary representation of the image at url
+    Retrieves a binary representation of the image at url. Uses cache (a PhotoCache) if given.
+    Returns None if the download failed, so error responses are never taken for the image.
     '''
-    http = urllib3.PoolManager()
+    if cache is not None and url is not None:
+        data = cache.get_photo(url)
+        if data is not None:
+            return(data)
+
+    http = get_client()
     try:
         if log is not None:
             log.debug('Retireving URL {}'.format(url))
         r = http.request('GET', url, headers = headers)
+        if r.status < 200 or r.status >= 300:
+            if log is not None:
+                log.error('Received status {} for {}'.format(r.status, url))
+            return(None)
+        if cache is not None:
+            cache.put_photo(url, r.data)
         return(r.data)
     except Exception as e:
         if log is not None:
             log.error(e)
-        return(None)
\ No newline at end of file
+        return(None)
+
+def open_photo(url, headers = None, chunk_size = 64 * 1024, log = None):
+    '''
+    Starts downloading the image at url without reading it into memory. Returns (chunks, size), where chunks is an
+    iterator over the body and size the announced Content-Length (or None), or (None, None) if the download failed.
+    '''
+    http = get_client()
+    try:
+        if log is not None:
+            log.debug('Streaming URL {}'.format(url))
+        r = http.request('GET', url, headers = headers, preload_content = False)
+    except Exception as e:
+        if log is not None:
+            log.error(e)
+        return((None, None))
+
+    if r.status != 200:
+        if log is not None:
+            log.error('Received status {} for {}'.format(r.status, url))
+        r.release_conn()
+        return((None, None))
+
+    def chunks():
+        try:
+            for chunk in r.stream(chunk_size):
+                metrics.count('http.bytes_received', len(chunk), service = http.name)
+                yield chunk
+        finally:
+            r.release_conn()
+
+    # The announced size only matches the stream if it is not content-encoded
+    size = r.headers.get('Content-Length')
+    if size is None or r.headers.get('Content-Encoding', 'identity') != 'identity':
+        return((chunks(), None))
+    return((chunks(), int(size)))
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+
+import os
+import json
+import hashlib
+import numpy as np
+
+from .text import recommender_text
+
+def fact_hash(fact):
+    '''
+    Hashes the recommender text of a fact, so edits to headline or first sentence can be detected
+    '''
+    return(hashlib.sha1(recommender_text(fact).encode('utf-8')).hexdigest())
+
+class VectorStore:
+    '''
+    On-disk store of fact vectors. Vectors live in a memory-mapped .npy file, next to a JSON index with the fact id and
+    text hash per row. Only new or edited facts are embedded again, deleted facts are dropped on sync.
+    '''
+    def __init__(self, path, model = '', log = None):
+        self.path = path
+        self.model = model
+        self.log = log
+        self.ids = list()
+        self.hashes = list()
+        self.vectors = None
+
+        if not os.path.isdir(path):
+            os.makedirs(path)
+
+        try:
+            with open(self.index_file(), 'r') as f:
+                index = json.load(f)
+            if index.get('model', '') == model:
+                self.ids = index['ids']
+                self.hashes = index['hashes']
+                self.vectors = np.load(self.vector_file(), mmap_mode = 'r')
+            elif log is not None:
+                log.debug('Vector store {} was built with model {}, rebuilding'.format(path, index.get('model', '')))
+        except (IOError, ValueError, KeyError):
+            if log is not None:
+                log.debug('No usable vector store at {}, starting empty'.format(path))
+            self.ids = list()
+            self.hashes = list()
+            self.vectors = None
+
+    def index_file(self):
+        return(os.path.join(self.path, 'index.json'))
+
+    def vector_file(self):
+        return(os.path.join(self.path, 'vectors.npy'))
+
+    def sync(self, facts, embed):
+        '''
+        Brings the store in line with facts and returns the vectors as a matrix with one row per fact (in order).
+        embed is called once with the list of new or edited facts and must return one row per fact.
+        '''
+        known = dict(((id, i) for (i, id) in enumerate(self.ids)))
+        ids = [str(f['id']) for f in facts]
+        hashes = [fact_hash(f) for f in facts]
+
+        keep_new = list()
+        keep_old = list()
+        changed = list()
+        for (i, (id, h)) in enumerate(zip(ids, hashes)):
+            j = known.get(id)
+            if j is not None and self.hashes[j] == h:
+                keep_new.append(i)
+                keep_old.append(j)
+            else:
+                changed.append(i)
+
+        if self.log is not None:
+            self.log.debug('Vector store: {} unchanged, {} to embed, {} evicted'.format(len(keep_new), len(changed), len(self.ids) - len(keep_old)))
+
+        if len(changed) > 0:
+            embedded = np.asarray(embed([facts[i] for i in changed]), dtype = np.float32)
+            width = embedded.shape[1]
+        else:
+            embedded = None
+            width = self.vectors.shape[1] if self.vectors is not None else 0
+
+        # Vectors from a different width can not be reused
+        if self.vectors is not None and self.vectors.shape[1] != width and len(keep_new) > 0:
+            if self.log is not None:
+                self.log.debug('Vector width changed, embedding all facts again')
+            self.ids = list()
+            self.hashes = list()
+            self.vectors = None
+            return(self.sync(facts, embed))
+
+        tmp = self.vector_file() + '.tmp'
+        vectors = np.lib.format.open_memmap(tmp, mode = 'w+', dtype = np.float32, shape = (len(facts), width))
+        if len(keep_new) > 0:
+            vectors[keep_new] = self.vectors[keep_old]
+        if embedded is not None:
+            vectors[changed] = embedded
+        vectors.flush()
+        del vectors
+
+        os.replace(tmp, self.vector_file())
+        with open(self.index_file() + '.tmp', 'w') as f:
+            json.dump({'model': self.model, 'ids': ids, 'hashes': hashes}, f)
+        os.replace(self.index_file() + '.tmp', self.index_file())
+
+        self.ids = ids
+        self.hashes = hashes
+        self.vectors = np.load(self.vector_file(), mmap_mode = 'r')
+
+        return(self.vectors)
@@ -21,8 +21,12 @@ setup(name='fff-utils',
         'boto3',
         'python-slugify',
         'py-trello',
+        'scipy',
         'urllib3'
       ],
+      extras_require={
+        'images': ['Pillow']
+      },
       classifiers = [
         'License :: OSI Approved :: MIT License',
         'Intended Audience :: Science/Research',
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+from fffutils.nlp import normalize_rows, find_all_similar_docs
+from fffutils.ann import IVFIndex
+
+def random_matrix(size, width = 16, seed = 0):
+    # Clustered rows, as the k-means of the index expects
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size = (8, width))
+    return(normalize_rows(centers[rng.integers(0, 8, size)] + 0.3 * rng.normal(size = (size, width))))
+
+def test_ivf_index_exact_when_probing_all_lists():
+    matrix = random_matrix(300)
+    index = IVFIndex.build(matrix, ids = [str(i) for i in range(300)], n_lists = 6)
+
+    approximate = index.find_all_similar_docs(n = 5, nprobe = 6, block_size = 64)
+    exact = find_all_similar_docs(matrix, n = 5)
+    scores = matrix @ matrix.T
+    rows = np.arange(300)[:, None]
+    assert np.allclose(scores[rows, approximate], scores[rows, exact])
+    assert not (approximate == np.arange(300)[:, None]).any()
+
+def test_ivf_index_search_pads_missing_neighbours():
+    matrix = random_matrix(4)
+    index = IVFIndex.build(matrix, n_lists = 1)
+    result = index.search(matrix, n = 6, exclude = np.arange(4))
+    assert (result[:, 3:] == -1).all()
+    assert (result[:, :3] >= 0).all()
+
+def test_ivf_index_save_load(tmp_path):
+    matrix = random_matrix(200)
+    ids = [str(i) for i in range(200)]
+    index = IVFIndex.build(matrix, ids = ids, n_lists = 5)
+    path = str(tmp_path / 'index.npz')
+    index.save(path)
+
+    loaded = IVFIndex.load(path)
+    assert loaded.ids == ids
+    loaded.add(matrix, ids)
+    assert (loaded.assignments == index.assignments).all()
+    assert (loaded.find_all_similar_docs(n = 3, nprobe = 2) == index.find_all_similar_docs(n = 3, nprobe = 2)).all()
+
+    # Other ids invalidate the saved assignments
+    loaded = IVFIndex.load(path)
+    loaded.add(matrix[:150], ids[:150])
+    assert len(loaded.assignments) == 150
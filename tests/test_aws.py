@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+
+import base64
+import hashlib
+import threading
+
+import pytest
+
+from fffutils import aws
+
+class FakeS3:
+    '''
+    Stores uploads in memory and checks the MD5 of every body like S3. With kms, ETags are not the MD5 of the
+    content, as with SSE-KMS or SSE-C encryption.
+    '''
+    def __init__(self, kms = False):
+        self.kms = kms
+        self.objects = dict()
+        self.parts = dict()
+        self.aborted = list()
+        self.lock = threading.Lock()
+
+    def etag(self, body):
+        return('"{}"'.format(hashlib.sha1(body).hexdigest()[:32] if self.kms else hashlib.md5(body).hexdigest()))
+
+    def check(self, body, md5):
+        if base64.b64encode(hashlib.md5(body).digest()).decode('ascii') != md5:
+            raise ValueError('BadDigest')
+
+    def put_object(self, Bucket, Key, Body, ContentType, ContentMD5):
+        self.check(Body, ContentMD5)
+        self.objects[Key] = Body
+        return({'ETag': self.etag(Body)})
+
+    def create_multipart_upload(self, Bucket, Key, ContentType):
+        return({'UploadId': 'u1'})
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, ContentMD5):
+        self.check(Body, ContentMD5)
+        with self.lock:
+            self.parts[PartNumber] = Body
+        return({'ETag': self.etag(Body)})
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        numbers = [p['PartNumber'] for p in MultipartUpload['Parts']]
+        assert [p['ETag'] for p in MultipartUpload['Parts']] == [self.etag(self.parts[n]) for n in numbers]
+        self.objects[Key] = b''.join(self.parts[n] for n in numbers)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.aborted.append(Key)
+
+@pytest.mark.parametrize('sizes', [[10], [3, 3, 3, 1], [1] * 10, [25], [0, 4, 0, 6]])
+def test_read_parts(sizes):
+    chunks = [bytes([i]) * size for (i, size) in enumerate(sizes)]
+    parts = list(aws.read_parts(chunks, part_size = 4))
+    assert b''.join(parts) == b''.join(chunks)
+    assert all(len(part) == 4 for part in parts[:-1])
+    assert 0 < len(parts[-1]) <= 4
+
+def test_read_parts_empty():
+    assert list(aws.read_parts([b'', b''], part_size = 4)) == list()
+
+@pytest.mark.parametrize('kms', [False, True])
+@pytest.mark.parametrize('size', [1, 8, 9, 40, 41])
+def test_upload_stream(monkeypatch, kms, size):
+    s3 = FakeS3(kms = kms)
+    monkeypatch.setattr(aws, 'get_client', lambda: s3)
+    data = bytes(i % 251 for i in range(size))
+    chunks = [data[i:i + 3] for i in range(0, size, 3)]
+
+    result = aws.upload_stream(iter(chunks), 'photo.jpg', 'bucket', part_size = 8, concurrency = 2, expected_size = size)
+    assert result == (hashlib.md5(data).hexdigest(), size)
+    assert s3.objects['photo.jpg'] == data
+    assert len(s3.parts) == (0 if size <= 8 else (size + 7) // 8)
+
+def test_upload_stream_size_mismatch(monkeypatch):
+    s3 = FakeS3()
+    monkeypatch.setattr(aws, 'get_client', lambda: s3)
+    assert aws.upload_stream(iter([b'x' * 20]), 'photo.jpg', 'bucket', part_size = 8, expected_size = 30) is None
+    assert s3.aborted == ['photo.jpg']
+    assert 'photo.jpg' not in s3.objects
+
+def test_upload_stream_no_data(monkeypatch):
+    s3 = FakeS3()
+    monkeypatch.setattr(aws, 'get_client', lambda: s3)
+    assert aws.upload_stream(iter([]), 'photo.jpg', 'bucket') is None
@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+
+import numpy as np
+import pytest
+
+from fffutils.lexical import lexical_matrices, find_all_similar_docs as find_all_lexical
+
+def brute_force(queries, documents, n):
+    '''
+    Expected neighbours: best positive scores first, ties by position, no self-matches, padded with -1
+    '''
+    scores = (queries @ documents.T).toarray()
+    np.fill_diagonal(scores, 0)
+    result = np.full((scores.shape[0], n), -1, dtype = np.int64)
+    for (i, row) in enumerate(scores):
+        order = [j for j in np.lexsort((np.arange(len(row)), -row)) if row[j] > 0][:n]
+        result[i, :len(order)] = order
+    return(result)
+
+FACTS = [
+    {'headline': 'Impfstoff schützt', 'snack': 'Der Impfstoff schützt vor schweren Verläufen. Mehr dazu.'},
+    {'headline': 'Impfstoff verändert nicht die DNA', 'snack': 'Ein Impfstoff gelangt nicht in den Zellkern.'},
+    {'headline': 'Masken helfen', 'snack': 'Masken halten Tröpfchen zurück. Quelle: RKI'},
+    {'headline': 'Fakt: Masken und Abstand', 'snack': 'Abstand und Masken senken das Risiko.'},
+    {'headline': 'Wetter', 'snack': 'Morgen regnet es.'},
+    {'headline': 'Falsch: Impfstoff mit Chip', 'snack': 'Im Impfstoff ist kein Chip.'}
+]
+
+@pytest.mark.parametrize('weighting', ['tfidf', 'bm25'])
+@pytest.mark.parametrize('dense_share', [0.0, 1e9])
+@pytest.mark.parametrize('block_size', [1, 4, 512])
+def test_lexical_neighbours(monkeypatch, weighting, dense_share, block_size):
+    # dense_share 0 ranks every block as dense array, 1e9 every block by its sparse scores
+    from fffutils import lexical
+    monkeypatch.setattr(lexical, 'DENSE_SHARE', dense_share)
+
+    (queries, documents) = lexical_matrices(FACTS, weighting = weighting)
+    neighbours = find_all_lexical(queries, documents, n = 3, block_size = block_size)
+
+    assert neighbours.shape == (len(FACTS), 3)
+    assert (neighbours == brute_force(queries, documents, 3)).all()
+    assert not (neighbours == np.arange(len(FACTS))[:, None]).any()
+
+    # Facts about the same topic recommend each other, a fact without shared words recommends nothing
+    assert set(neighbours[0][:2]) <= {1, 5}
+    assert neighbours[2][0] == 3
+    assert (neighbours[4] == -1).all()
+
+@pytest.mark.parametrize('dense_share', [0.0, 1e9])
+def test_lexical_neighbours_more_than_corpus(monkeypatch, dense_share):
+    # Asking for more neighbours than there are facts pads every row with -1
+    from fffutils import lexical
+    monkeypatch.setattr(lexical, 'DENSE_SHARE', dense_share)
+
+    (queries, documents) = lexical_matrices(FACTS[:2], weighting = 'tfidf')
+    neighbours = find_all_lexical(queries, documents, n = 3)
+
+    assert neighbours.shape == (2, 3)
+    assert (neighbours == brute_force(queries, documents, 3)).all()
+    assert (neighbours[:, 0] == [1, 0]).all()
+    assert (neighbours[:, 1:] == -1).all()
+
+def test_lexical_unknown_weighting():
+    with pytest.raises(ValueError):
+        lexical_matrices(FACTS, weighting = 'word2vec')
@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+
+import json
+
+import pytest
+
+from fffutils import metrics
+
+@pytest.fixture(autouse = True)
+def reset():
+    metrics.reset()
+    yield
+    metrics.reset()
+
+def test_prometheus_counters():
+    metrics.count('http.requests', service = 'strapi', status = '2xx')
+    metrics.count('http.requests', 2, service = 'strapi', status = '5xx')
+    metrics.count('cards.skipped')
+    metrics.count('errors', stage = 'say "hi"\\')
+
+    lines = metrics.prometheus().splitlines()
+    assert lines.count('# TYPE fffutils_http_requests_total counter') == 1
+    assert 'fffutils_http_requests_total{service="strapi",status="2xx"} 1' in lines
+    assert 'fffutils_http_requests_total{service="strapi",status="5xx"} 2' in lines
+    assert 'fffutils_cards_skipped_total 1' in lines
+    assert 'fffutils_errors_total{stage="say \\"hi\\"\\\\"} 1' in lines
+
+def test_prometheus_histogram():
+    for seconds in [0.0005, 0.02, 0.02, 0.3, 120.0]:
+        metrics.observe('s3.put_object', seconds, bucket = 'fff-sharepics')
+
+    lines = metrics.prometheus().splitlines()
+    assert lines[0] == '# TYPE fffutils_s3_put_object_seconds histogram'
+    buckets = [line for line in lines if line.startswith('fffutils_s3_put_object_seconds_bucket')]
+    assert len(buckets) == len(metrics.BUCKETS) + 1
+
+    # Buckets are cumulative, durations above the largest bound only count towards +Inf
+    assert 'fffutils_s3_put_object_seconds_bucket{bucket="fff-sharepics",le="0.001"} 1' in buckets
+    assert 'fffutils_s3_put_object_seconds_bucket{bucket="fff-sharepics",le="0.025"} 3' in buckets
+    assert 'fffutils_s3_put_object_seconds_bucket{bucket="fff-sharepics",le="60.0"} 4' in buckets
+    assert buckets[-1] == 'fffutils_s3_put_object_seconds_bucket{bucket="fff-sharepics",le="+Inf"} 5'
+    assert 'fffutils_s3_put_object_seconds_count{bucket="fff-sharepics"} 5' in lines
+    assert [float(line.split()[1]) for line in lines if line.startswith('fffutils_s3_put_object_seconds_sum')] == [pytest.approx(120.3405)]
+
+def test_span_counts_errors():
+    with pytest.raises(ValueError):
+        with metrics.span('strapi.upsert'):
+            raise ValueError('failed')
+
+    lines = metrics.prometheus().splitlines()
+    assert 'fffutils_errors_total{stage="strapi.upsert"} 1' in lines
+    assert 'fffutils_strapi_upsert_seconds_count 1' in lines
+
+def test_write(tmp_path):
+    metrics.count('cards.skipped', 3)
+
+    metrics.write(str(tmp_path / 'fffutils.prom'))
+    assert (tmp_path / 'fffutils.prom').read_text() == metrics.prometheus()
+
+    metrics.write(str(tmp_path / 'metrics.json'))
+    data = json.loads((tmp_path / 'metrics.json').read_text())
+    assert data['counters'] == [{'name': 'cards.skipped', 'labels': {}, 'value': 3}]
+    assert not (tmp_path / 'metrics.json.tmp').exists()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+
+import gzip
+import json
+
+import pytest
+
+from fffutils.reader import read_records
+
+RECORDS = [
+    {'headline': 'Erster', 'snack': 'Text mit "Anführungszeichen", Komma und ] Klammer', 'n': 1},
+    {'headline': 'Zweiter', 'snack': 'Ümläute und {geschweifte} Klammern', 'n': 22},
+    {'headline': 'Dritter', 'snack': '', 'n': 333, 'tags': ['a', 'b']}
+]
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 64, 65536])
+@pytest.mark.parametrize('layout', ['array', 'lines', 'array-compact'])
+def test_read_records_across_chunks(tmp_path, chunk_size, layout):
+    if layout == 'array':
+        content = json.dumps(RECORDS, indent = 2, ensure_ascii = False)
+    elif layout == 'array-compact':
+        content = json.dumps(RECORDS, separators = (',', ':'), ensure_ascii = False)
+    else:
+        content = '\n'.join(json.dumps(r, ensure_ascii = False) for r in RECORDS) + '\n'
+    path = tmp_path / 'data.json'
+    path.write_text(content, encoding = 'utf-8')
+
+    assert list(read_records(str(path), chunk_size = chunk_size)) == RECORDS
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 4])
+def test_read_records_numbers_at_chunk_end(tmp_path, chunk_size):
+    # A number split by the chunk boundary must not be returned in parts
+    path = tmp_path / 'numbers.jsonl'
+    path.write_text('1\n22\n333\n4444', encoding = 'utf-8')
+    assert list(read_records(str(path), chunk_size = chunk_size)) == [1, 22, 333, 4444]
+
+def test_read_records_gzip(tmp_path):
+    path = tmp_path / 'data.json.gz'
+    with gzip.open(str(path), 'wt', encoding = 'utf-8') as f:
+        json.dump(RECORDS, f)
+    assert list(read_records(str(path), chunk_size = 5)) == RECORDS
+
+def test_read_records_empty_array(tmp_path):
+    path = tmp_path / 'empty.json'
+    path.write_text(' [ ] ', encoding = 'utf-8')
+    assert list(read_records(str(path), chunk_size = 1)) == list()
+
+def test_read_records_truncated(tmp_path):
+    path = tmp_path / 'truncated.json'
+    path.write_text(json.dumps(RECORDS)[:-1], encoding = 'utf-8')
+    with pytest.raises(ValueError):
+        list(read_records(str(path), chunk_size = 8))
+
+    path.write_text(json.dumps(RECORDS)[:-20], encoding = 'utf-8')
+    with pytest.raises(ValueError):
+        list(read_records(str(path), chunk_size = 8))
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+
+from concurrent.futures import ThreadPoolExecutor
+
+from fffutils.state import SyncState, snack_hash
+
+def test_sync_state_record_and_reload(tmp_path):
+    path = str(tmp_path / 'state.db')
+    state = SyncState(path)
+    assert state.get('card1') is None
+    assert not state.is_unchanged('card1', '2021-03-01T10:00:00.000Z')
+
+    state.record('card1', '2021-03-01T10:00:00.000Z', 'hash1', 'a1')
+    assert state.is_unchanged('card1', '2021-03-01T10:00:00.000Z')
+    assert not state.is_unchanged('card1', '2021-03-02T10:00:00.000Z')
+    state.close()
+
+    # Later runs see the last record of a card
+    state = SyncState(path)
+    assert state.get('card1') == ('2021-03-01T10:00:00.000Z', 'hash1', 'a1')
+    state.record('card1', '2021-03-02T10:00:00.000Z', 'hash2', 'a1')
+    assert state.get('card1') == ('2021-03-02T10:00:00.000Z', 'hash2', 'a1')
+    state.close()
+
+def test_sync_state_concurrent_records(tmp_path):
+    state = SyncState(str(tmp_path / 'state.db'))
+    with ThreadPoolExecutor(max_workers = 8) as executor:
+        list(executor.map(lambda i: state.record('card{}'.format(i), str(i), 'hash', str(i)), range(100)))
+    assert all(state.is_unchanged('card{}'.format(i), str(i)) for i in range(100))
+    state.close()
+
+def test_snack_hash_ignores_cms_id():
+    snack = {'headline': 'Erster', 'snack': 'Text', 'tags': ['a']}
+    assert snack_hash(dict(snack, _id = 'a1')) == snack_hash(snack)
+    assert snack_hash(dict(reversed(list(snack.items())))) == snack_hash(snack)
+    assert snack_hash(dict(snack, snack = 'Neu')) != snack_hash(snack)
@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+import json
+
+import pytest
+
+from fffutils import strapi
+
+@pytest.mark.parametrize(('field', 'a', 'b', 'expected'), [
+    ('headline', 'Titel', 'Titel', True),
+    ('headline', 'Titel', 'Titel ', False),
+    ('tags', '', None, False),
+    ('date', '2021-03-01T10:00:00', '2021-03-01T10:00:00.000Z', True),
+    ('date', '2021-03-01T12:00:00+02:00', '2021-03-01T10:00:00.000Z', True),
+    ('date', '2021-03-01T10:00:01', '2021-03-01T10:00:00.000Z', False),
+    ('date', 'gestern', '2021-03-01T10:00:00.000Z', False),
+    ('valid_through', '2021-03-01', '2021-03-01T00:00:00.000Z', True),
+    ('url', '2021-03-01', '2021-03-01T00:00:00.000Z', False)
+])
+def test_same_value(field, a, b, expected):
+    assert strapi.same_value(field, a, b) == expected
+
+class FakeResponse:
+    def __init__(self, status, body):
+        self.status = status
+        self.data = json.dumps(body).encode('utf-8')
+
+class FakeClient:
+    '''
+    Records the requests of an Upserter and answers like Strapi
+    '''
+    def __init__(self, status = 200):
+        self.status = status
+        self.requests = list()
+        self.headers = {'Authorization': 'Bearer test'}
+
+    def request(self, method, url, body = None, headers = None, **kwargs):
+        body = json.loads(body)
+        self.requests.append((method, url, body))
+        if self.status >= 300:
+            return(FakeResponse(self.status, {'error': 'Internal Server Error'}))
+        return(FakeResponse(self.status, dict(body, _id = url.rsplit('/', 1)[1] if method == 'PUT' else 'new')))
+
+@pytest.fixture
+def upserter(tmp_path, monkeypatch):
+    snapshot = tmp_path / 'snapshot.json'
+    snapshot.write_text(json.dumps([
+        {'_id': 'a1', 'slug': 'erster', 'headline': 'Erster', 'snack': 'Alt', 'date': '2021-03-01T10:00:00.000Z'},
+        {'_id': 'b2', 'slug': 'zweiter', 'headline': 'Zweiter', 'snack': 'Text', 'date': '2021-03-02T10:00:00.000Z'}
+    ]), encoding = 'utf-8')
+
+    client = FakeClient()
+    monkeypatch.setattr(strapi, 'get_client', lambda auth = True, pool_size = None: client)
+    upserter = strapi.Upserter(str(snapshot))
+    upserter.client = client
+    return(upserter)
+
+def test_upsert_unchanged(upserter):
+    result = upserter.upsert({'_id': 'b2', 'slug': 'zweiter', 'headline': 'Zweiter', 'snack': 'Text', 'date': '2021-03-02T10:00:00'})
+    assert result['action'] == 'unchanged'
+    assert result['id'] == 'b2'
+    assert upserter.client.requests == list()
+
+def test_upsert_sends_only_changes(upserter):
+    result = upserter.upsert({'_id': 'a1', 'slug': 'erster', 'headline': 'Erster', 'snack': 'Neu', 'date': '2021-03-01T10:00:00'})
+    assert result['action'] == 'updated'
+    assert upserter.client.requests == [('PUT', strapi.STRAPI_URL + '/facts/a1', {'snack': 'Neu'})]
+
+    # The stored record is updated, so the same snack is unchanged afterwards
+    assert upserter.upsert({'_id': 'a1', 'slug': 'erster', 'headline': 'Erster', 'snack': 'Neu'})['action'] == 'unchanged'
+    assert len(upserter.client.requests) == 1
+
+def test_upsert_matches_by_slug(upserter):
+    result = upserter.upsert({'_id': '', 'slug': 'erster', 'headline': 'Erster', 'snack': 'Alt'})
+    assert (result['action'], result['id']) == ('unchanged', 'a1')
+
+def test_upsert_creates_unknown(upserter):
+    result = upserter.upsert({'_id': '', 'slug': 'dritter', 'headline': 'Dritter', 'snack': 'Text'})
+    assert result['action'] == 'created'
+    assert upserter.client.requests == [('POST', strapi.STRAPI_URL + '/facts', {'slug': 'dritter', 'headline': 'Dritter', 'snack': 'Text'})]
+    assert upserter.stats['created'] == 1
+
+def test_upsert_failure(upserter):
+    upserter.client.status = 500
+    result = upserter.upsert({'_id': 'a1', 'slug': 'erster', 'headline': 'Erster', 'snack': 'Neu'})
+    assert (result['action'], result['status'], result['id']) == ('failed', 500, None)
+    assert upserter.stats['failed'] == 1
+
+def test_upsert_summary(upserter):
+    snacks = [
+        {'_id': 'a1', 'slug': 'erster', 'headline': 'Erster', 'snack': 'Neu'},
+        {'_id': 'b2', 'slug': 'zweiter', 'headline': 'Zweiter', 'snack': 'Text'},
+        {'_id': '', 'slug': 'dritter', 'headline': 'Dritter', 'snack': 'Text'}
+    ]
+    (results, summary) = strapi.upsert(snacks, upserter, in_flight = 2)
+    assert [r['action'] for r in results] == ['updated', 'unchanged', 'created']
+    assert (summary['created'], summary['updated'], summary['unchanged'], summary['failed']) == (1, 1, 1, 0)
+
+    # Only the requests sent are timed
+    assert summary['requests'] == 2
+    assert results[1]['latency'] is None
+    assert summary['latency_max'] >= summary['latency_p50'] >= 0
+
+def test_fact_page_raises_on_error(monkeypatch):
+    # An error page must not be taken for a (short, last) page of facts
+    client = FakeClient(status = 503)
+    client.request = lambda method, url, **kwargs: FakeResponse(503, {'error': 'Service Unavailable'})
+    monkeypatch.setattr(strapi, 'get_client', lambda auth = True, pool_size = None: client)
+    with pytest.raises(ValueError):
+        list(strapi.iter_facts(page_size = 10, concurrency = 2, fields = ['id', 'headline']))
+
+class FakeRecommendations(FakeClient):
+    '''
+    Serves the recommendation records of Strapi and records the changes sent
+    '''
+    def __init__(self, records):
+        super().__init__()
+        self.records = records
+
+    def request(self, method, url, body = None, headers = None, **kwargs):
+        if method == 'GET':
+            return(FakeResponse(200, self.records))
+        self.requests.append((method, url, json.loads(body) if body is not None else None))
+        if method == 'POST':
+            return(FakeResponse(200, dict(json.loads(body), id = 99)))
+        record = [r for r in self.records if str(r['id']) == url.rsplit('/', 1)[1]][0]
+        return(FakeResponse(200, dict(record, **json.loads(body or '{}'))))
+
+@pytest.mark.parametrize('ids', [('r1', 'r2', 'r3'), (1, 2, 3)])
+def test_publish_recommendations(monkeypatch, ids):
+    # MongoDB records have string ids, SQL databases integers
+    client = FakeRecommendations([
+        {'id': ids[0], 'fact': 'a', 'recommends': [{'id': 'b'}, {'id': 'c'}]},
+        {'id': ids[1], 'fact': {'id': 'b'}, 'recommends': ['a']},
+        {'id': ids[2], 'fact': 'b', 'recommends': ['c']}
+    ])
+    monkeypatch.setattr(strapi, 'get_client', lambda auth = True, pool_size = None: client)
+
+    (results, summary) = strapi.publish_recommendations([('a', ['b', 'c']), ('b', ['c', 'a']), ('c', ['a'])], in_flight = 2, prune = True)
+    assert [(r['action'], r['id']) for r in results] == [('unchanged', ids[0]), ('updated', ids[1]), ('created', 99)]
+    assert (summary['created'], summary['updated'], summary['unchanged'], summary['failed']) == (1, 1, 1, 0)
+    assert (summary['duplicates'], summary['deleted']) == (1, 1)
+    assert sorted(client.requests, key = lambda r: r[0]) == [
+        ('DELETE', strapi.STRAPI_URL + '/recommendations/{}'.format(ids[2]), None),
+        ('POST', strapi.STRAPI_URL + '/recommendations', {'fact': 'c', 'recommends': ['a']}),
+        ('PUT', strapi.STRAPI_URL + '/recommendations/{}'.format(ids[1]), {'recommends': ['c', 'a']})
+    ]
+
+def test_client_pool_fits_in_flight(monkeypatch):
+    monkeypatch.setattr(strapi, '_client', None)
+    client = strapi.get_client(auth = False)
+    assert client.pool_size == 10
+
+    # A larger pool replaces the shared client, smaller ones reuse it
+    bulk = strapi.get_client(auth = False, pool_size = 16)
+    assert bulk.pool_size == 16 and bulk is not client
+    assert strapi.get_client(auth = False, pool_size = 4) is bulk
+    assert strapi.get_client(auth = False) is bulk
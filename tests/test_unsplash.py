@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+import os
+
+import pytest
+
+from fffutils import unsplash
+from fffutils.unsplash import PhotoCache
+
+class Clock:
+    '''
+    Stands in for the time module, so cache entries get distinct, controlled timestamps
+    '''
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        self.now += 1
+        return(self.now)
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(unsplash, 'time', clock)
+    return(clock)
+
+def test_photo_cache_url_ttl(tmp_path, clock):
+    cache = PhotoCache(str(tmp_path), ttl = 60)
+    assert cache.get_url('abc', 'regular') is None
+    cache.put_urls('abc', {'regular': 'https://images.unsplash.com/abc?w=1080'})
+
+    assert cache.get_url('abc', 'regular') == 'https://images.unsplash.com/abc?w=1080'
+    assert cache.get_url('abc', 'full') is None
+
+    # Expired URLs are fetched again
+    clock.now += 60
+    assert cache.get_url('abc', 'regular') is None
+    assert (cache.stats['url_hits'], cache.stats['url_misses']) == (1, 3)
+
+def test_photo_cache_evicts_least_recently_used(tmp_path, clock):
+    cache = PhotoCache(str(tmp_path), max_bytes = 10)
+    cache.put_photo('a', b'a' * 4)
+    cache.put_photo('b', b'b' * 4)
+
+    # Reading a makes b the least recently used photo
+    assert cache.get_photo('a') == b'a' * 4
+    cache.put_photo('c', b'c' * 4)
+
+    assert cache.get_photo('b') is None
+    assert cache.get_photo('a') == b'a' * 4
+    assert cache.get_photo('c') == b'c' * 4
+    assert cache.stats['evicted'] == 1
+    assert not os.path.exists(cache.photo_file('b'))
+
+def test_photo_cache_larger_than_limit(tmp_path, clock):
+    cache = PhotoCache(str(tmp_path), max_bytes = 10)
+    cache.put_photo('a', b'a' * 4)
+    cache.put_photo('big', b'x' * 12)
+    assert cache.get_photo('a') is None
+    assert cache.get_photo('big') is None
+    assert cache.stats['evicted'] == 2
+
+def test_photo_cache_save_load(tmp_path, clock):
+    cache = PhotoCache(str(tmp_path))
+    cache.put_urls('abc', {'regular': 'https://images.unsplash.com/abc'})
+    cache.put_photo('https://images.unsplash.com/abc', b'jpeg')
+    cache.save()
+
+    loaded = PhotoCache(str(tmp_path))
+    assert loaded.get_url('abc', 'regular') == 'https://images.unsplash.com/abc'
+    assert loaded.get_photo('https://images.unsplash.com/abc') == b'jpeg'
+
+    # A photo file removed from disk is a miss and dropped from the index
+    os.remove(loaded.photo_file('https://images.unsplash.com/abc'))
+    assert loaded.get_photo('https://images.unsplash.com/abc') is None
+    assert loaded.photos == dict()
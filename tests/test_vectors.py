@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+
+import numpy as np
+
+from fffutils.vectors import VectorStore
+
+FACTS = [
+    {'id': 1, 'headline': 'Impfstoff schützt', 'snack': 'Der Impfstoff schützt vor schweren Verläufen.'},
+    {'id': 2, 'headline': 'Masken helfen', 'snack': 'Masken halten Tröpfchen zurück.'},
+    {'id': 3, 'headline': 'Wetter', 'snack': 'Morgen regnet es.'}
+]
+
+class Embedder:
+    '''
+    Embeds facts by their id and records which facts were embedded
+    '''
+    def __init__(self, width = 4):
+        self.width = width
+        self.calls = list()
+
+    def __call__(self, facts):
+        self.calls.append([f['id'] for f in facts])
+        return([[f['id']] * self.width for f in facts])
+
+def test_vector_store_embeds_only_changes(tmp_path):
+    embed = Embedder()
+    store = VectorStore(str(tmp_path), model = 'model-1')
+    assert (store.sync(FACTS, embed)[:, 0] == [1, 2, 3]).all()
+    assert embed.calls == [[1, 2, 3]]
+
+    # Reloaded from disk: unchanged facts are not embedded again
+    store = VectorStore(str(tmp_path), model = 'model-1')
+    assert (store.sync(FACTS, embed)[:, 0] == [1, 2, 3]).all()
+    assert len(embed.calls) == 1
+
+    # A new and an edited fact are embedded, a deleted one is evicted, rows follow the order of facts
+    facts = [dict(FACTS[2], headline = 'Regen'), {'id': 4, 'headline': 'Neu', 'snack': 'Neuer Text.'}, FACTS[0]]
+    matrix = store.sync(facts, embed)
+    assert embed.calls[1] == [3, 4]
+    assert (matrix[:, 0] == [3, 4, 1]).all()
+    assert VectorStore(str(tmp_path), model = 'model-1').ids == ['3', '4', '1']
+
+def test_vector_store_other_model(tmp_path):
+    embed = Embedder()
+    VectorStore(str(tmp_path), model = 'de_core_news_sm-3.0.0/3.0.6').sync(FACTS, embed)
+
+    # Vectors of another model version are not reused
+    store = VectorStore(str(tmp_path), model = 'de_core_news_sm-3.1.0/3.1.3')
+    assert store.ids == list()
+    store.sync(FACTS, embed)
+    assert embed.calls == [[1, 2, 3], [1, 2, 3]]
+
+def test_vector_store_width_change(tmp_path):
+    store = VectorStore(str(tmp_path))
+    store.sync(FACTS[:2], Embedder(width = 4))
+
+    # Vectors of another width can not be combined, all facts are embedded again
+    embed = Embedder(width = 6)
+    matrix = store.sync(FACTS, embed)
+    assert embed.calls == [[3], [1, 2, 3]]
+    assert matrix.shape == (3, 6)
+    assert np.asarray(matrix).dtype == np.float32